@@ -1,69 +1,204 @@
 import asyncio
+import json
 import os
-from core.audio import Audio
+import pysrt
+from core.audio import Audio, WHISPER_MODEL
+from core.transcription import TRANSCRIPTION_BACKEND
 from core.export import Export
-from core.translation import Translation
+from core.translation import Translation, PROMPT_VERSION
+from core.llm import LLM
+from core.translation_memory import TranslationMemory
 from core.video import GenerateVideo
-from core.dubbed_video_generation import combine_audio_with_timing
+from core.tts import TTSEngine, TTSWorkerPool, TTSCache
+from core.pipeline import Pipeline
+from core.pcm_store import PCMStore, SPEECH_FORMAT, FULL_FORMAT
+from core.reference import select_reference_clip, REFERENCE_SECONDS
+from core.separation import DEMUCS_MODEL, DEMUCS_SEGMENT
+from core.segmentation import resegment, split_back, MAX_UNIT_SECONDS, MAX_UNIT_CHARS, MAX_GAP_SECONDS
+from core.dubbed_video_generation import mix_dub_track, SAMPLE_RATE
 
-async def translate_video(video_path, video_language, target_language):
-  audio_path = Audio().extract_audio(video_path)
+# x264 preset for subtitle burn-in; it changes the encoded file, so it's part of the render key
+X264_PRESET = os.getenv("X264_PRESET", "medium")
 
-  result = Audio().transcribe(audio_path, video_language)
-  srt_path = Export().generate_srt(result)
+def extract_audio_stage(out_dir, video):
+  return Audio().extract_pcm(video, f"{out_dir}/pcm").root
 
-  srt_path = await Translation().translate_srt(srt_path, video_language, target_language, f"temp/result_{target_language}.srt")
-  
+def transcribe_stage(out_dir, audio, language, word_timestamps=False):
+  samples = PCMStore(audio).load(*SPEECH_FORMAT)
+  result = Audio().transcribe(samples, language, workers=int(os.getenv("TRANSCRIBE_WORKERS") or 1),
+                              word_timestamps=word_timestamps)
+  transcript_path = f"{out_dir}/transcript.json"
+  with open(transcript_path, "w", encoding="utf-8") as f:
+    json.dump(result, f, ensure_ascii=False, default=float)
+  return transcript_path
+
+def resegment_stage(out_dir, transcript):
+  """Sentence-sized units (one LLM line, TTS call and mix input each) plus their SRT"""
+  with open(transcript, "r", encoding="utf-8") as f:
+    result = json.load(f)
+  units = resegment(result["segments"])
+  units_path = f"{out_dir}/units.json"
+  with open(units_path, "w", encoding="utf-8") as f:
+    json.dump(units, f, ensure_ascii=False)
+  return {"srt": Export().generate_srt({"segments": units}, f"{out_dir}/result.srt"), "units": units_path}
+
+async def translate_stage(out_dir, units, from_language, to_language, llm=None, memory=None, backend="llm"):
+  translation = Translation(llm, memory, backend)
+  srt_path = await translation.translate_srt(units["srt"], from_language, to_language, f"{out_dir}/result_{to_language}.srt", f"{out_dir}/result_{to_language}.txt")
+  translation.report()
+
+  # Subtitles go back to the original segment timing
+  with open(units["units"], "r", encoding="utf-8") as f:
+    unit_segments = json.load(f)
+  translations = [sub.text for sub in pysrt.open(srt_path, encoding="utf-8")]
+  subtitles_path = Export().generate_srt({"segments": split_back(unit_segments, translations)}, f"{out_dir}/subtitles_{to_language}.srt")
+  return {"srt": srt_path, "text": f"{out_dir}/result_{to_language}.txt", "subtitles": subtitles_path}
+
+def separate_stage(out_dir, audio):
+  vocals, instrumental = Audio().separate_audio_with_demucs(PCMStore(audio).load(*FULL_FORMAT), FULL_FORMAT[0])
+  return {"vocals": vocals, "instrumental": instrumental}
+
+def reference_stage(out_dir, stems, transcript):
+  with open(transcript, "r", encoding="utf-8") as f:
+    segments = json.load(f)["segments"]
+  return select_reference_clip(stems["vocals"], segments, f"{out_dir}/reference.wav", background_path=stems["instrumental"])
+
+def tts_stage(out_dir, reference, translation, tts_workers=1):
+  # One line per subtitle, so clip i always lines up with subtitle i in mix_dub_track
+  lines = [" ".join(sub.text.split()) for sub in pysrt.open(translation["srt"], encoding="utf-8")]
+
+  tts_cache = TTSCache()
+  if tts_workers > 1:
+    tts_engine = TTSWorkerPool(reference, workers=tts_workers, cache=tts_cache)
+  else:
+    tts_engine = TTSEngine(reference, cache=tts_cache)
+
+  with tts_engine as tts:
+    tts.generate_many(lines, f"{out_dir}/dubbed")
+  tts_cache.report()
+  return f"{out_dir}/dubbed"
+
+def render_subtitled_video(video_path, srt_path, lang, output_file):
   video_gen = GenerateVideo(
     video=video_path,
     subtitles=srt_path, 
-    lang=target_language, 
-    title=target_language,
-    output_file=f"output/output_{target_language}.mp4"
+    lang=lang, 
+    title=lang,
+    output_file=output_file,
+    render_chunks=int(os.getenv("RENDER_CHUNKS", "1")),
+    x264_preset=X264_PRESET
   )
   
   video_gen.generate_video()
   video_gen.cleanup_temp_files()
+  return output_file
 
-async def dub_video_to_en(video_path, video_language):
-  audio_path = Audio().extract_audio(video_path)
-  result = Audio().transcribe(audio_path, video_language)
-  srt_path = Export().generate_srt(result)
-  srt_path = await Translation().translate_srt(srt_path, video_language, "en", f"temp/result_en.srt", f"temp/result_en.txt")
-  os.makedirs("temp/dubbed", exist_ok=True)
-  with open("temp/result_en.txt", "r", encoding="utf-8") as f:
-    lines = f.read()
-    lines = lines.split("\n")
-    lines = [line.strip() for line in lines if line.strip()]
-
-    for i,line in enumerate(lines):
-      translated_audio_path = Audio().generate_translated_audio(audio_path, line, f"temp/dubbed/translated_audio_{i}.wav")
-      print(translated_audio_path)
-
-  vocals, instrumental = Audio().separate_audio_with_demucs(audio_path)
-
-  audio_path = combine_audio_with_timing("temp/dubbed", "temp/result_en.srt", instrumental, "temp/final_combined_audio.wav")
-  print(audio_path)
+def render_dubbed_video(video_path, dubbed_dir, srt_path, instrumental, output_file):
+  # The mixed track is piped straight into the final mux, no intermediate WAV
+  dub_track = mix_dub_track(dubbed_dir, srt_path, instrumental)
 
   video_gen = GenerateVideo(
     video=video_path,
     subtitles=None, 
     lang="en", 
     title="en",
-    output_file=f"output/output_en.mp4",
-    audio=audio_path
+    output_file=output_file,
+    audio_samples=dub_track,
+    audio_sample_rate=SAMPLE_RATE
   )
 
   video_gen.generate_video()
   video_gen.cleanup_temp_files()
+  return output_file
 
+def build_pipeline(video_path, video_language, target_languages, dub=False, tts_workers=1, output_prefix=None,
+                   translation_backend="llm"):
+  """
+  Stage graph for one video: a single extraction and transcription shared by every
+  target language, one translation per language, subtitled renders and the English dub.
+  """
+  name = output_prefix or os.path.splitext(os.path.basename(video_path))[0]
+  llm_model = os.getenv('OPENROUTER_LLM_MODEL') if translation_backend == "llm" else "argostranslate"
+  # One client for every language, so the rate limits apply to the whole job
+  llm = LLM() if translation_backend == "llm" else None
+  memory = TranslationMemory()
+  pipeline = Pipeline()
 
-def main():
-  # Translate video to arabic (Subtitles tr -> ar)
-  asyncio.run(translate_video("demo/02.mp4", "tr", "ar"))
+  pipeline.add("extract_audio", extract_audio_stage, sources={"video": video_path}, params={"format": "pcm_f32"})
+  pipeline.add("transcribe", lambda out_dir, audio: transcribe_stage(out_dir, audio, video_language, pipeline.requires("word_timestamps")),
+               inputs={"audio": "extract_audio"},
+               params={"model": WHISPER_MODEL, "backend": TRANSCRIPTION_BACKEND, "language": video_language})
+  pipeline.add("resegment", resegment_stage, inputs={"transcript": "transcribe"},
+               params={"max_seconds": MAX_UNIT_SECONDS, "max_chars": MAX_UNIT_CHARS, "max_gap": MAX_GAP_SECONDS})
+
+  languages = list(dict.fromkeys(list(target_languages) + (["en"] if dub else [])))
+  for lang in languages:
+    pipeline.add(
+      f"translate_{lang}",
+      lambda out_dir, units, lang=lang: translate_stage(out_dir, units, video_language, lang, llm, memory, translation_backend),
+      inputs={"units": "resegment"},
+      params={"from": video_language, "to": lang, "model": llm_model, "prompt_version": PROMPT_VERSION}
+    )
+
+  for lang in target_languages:
+    pipeline.add(
+      f"render_{lang}",
+      lambda out_dir, translation, video, lang=lang: render_subtitled_video(video, translation["subtitles"], lang, f"output/{name}_{lang}.mp4"),
+      inputs={"translation": f"translate_{lang}"},
+      sources={"video": video_path},
+      params={"output": f"output/{name}_{lang}.mp4", "x264_preset": X264_PRESET}
+    )
+
+  # Dubbing is only available in English
+  if dub:
+    # Separation runs first so the voice prompt comes from the clean vocals stem
+    pipeline.add("separate", separate_stage, inputs={"audio": "extract_audio"},
+                 params={"method": "demucs", "model": DEMUCS_MODEL, "segment": DEMUCS_SEGMENT})
+    pipeline.add("reference", reference_stage, inputs={"stems": "separate", "transcript": "transcribe"},
+                 params={"seconds": REFERENCE_SECONDS})
+    pipeline.add(
+      "tts",
+      lambda out_dir, reference, translation: tts_stage(out_dir, reference, translation, tts_workers),
+      inputs={"reference": "reference", "translation": "translate_en"},
+      params={"model": "chatterbox"}
+    )
+    pipeline.add(
+      "render_dub",
+      lambda out_dir, dubbed, translation, stems, video: render_dubbed_video(video, dubbed, translation["srt"], stems["instrumental"], f"output/{name}_en_dub.mp4"),
+      inputs={"dubbed": "tts", "translation": "translate_en", "stems": "separate"},
+      sources={"video": video_path},
+      params={"output": f"output/{name}_en_dub.mp4"}
+    )
+
+  # Word-level alignment only runs when a stage declared requires={"word_timestamps"}
+  pipeline.stages["transcribe"].params["word_timestamps"] = pipeline.requires("word_timestamps")
+  return pipeline
+
+async def translate_video_multi(video_path, video_language, target_languages, dub=False, tts_workers=1, dry_run=False, output_prefix=None,
+                                translation_backend="llm"):
+  """
+  Fan-out entry point: extract and transcribe once, translate into every target
+  language concurrently, then render each subtitled output (and the English dub)
+  from the shared artifacts. Outputs go to output/{video}_{lang}.mp4.
 
-  # Dub video to english (Audio tr -> en) (Only english supported for now)
-  asyncio.run(dub_video_to_en("demo/02.mp4", "tr"))
+  Finished stages are cached by content hash, so a re-run only executes what changed;
+  dry_run only prints which stages would run. translation_backend is "llm" (OpenRouter)
+  or "local" (installed argostranslate models, no network).
+  """
+  pipeline = build_pipeline(video_path, video_language, target_languages, dub, tts_workers, output_prefix, translation_backend)
+  return await pipeline.run(dry_run=dry_run)
+
+async def translate_video(video_path, video_language, target_language):
+  return await translate_video_multi(video_path, video_language, [target_language], output_prefix="output")
+
+async def dub_video_to_en(video_path, video_language, tts_workers=1):
+  return await translate_video_multi(video_path, video_language, [], dub=True, tts_workers=tts_workers, output_prefix="output")
+
+
+def main():
+  # Translate video to arabic (Subtitles tr -> ar) and dub it to english (Audio tr -> en),
+  # sharing a single audio extraction and transcription
+  asyncio.run(translate_video_multi("demo/02.mp4", "tr", ["ar"], dub=True))
 
 if __name__ == "__main__":
-  main()
\ No newline at end of file
+  main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark transcription backends on the same clip.
+
+Every backend runs in its own subprocess so peak memory isn't shared between
+runs. Reports load time, transcription time, real-time factor (transcription
+time / audio duration) and peak RSS.
+
+Usage: python benchmark_transcription.py [audio_path] [language] [model_size]
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BACKENDS = ["whisper_timestamped", "ctranslate2"]
+
+def run_backend(backend, audio_path, language, model_size):
+    import whisper
+    from core.audio import Audio
+
+    audio = whisper.load_audio(audio_path)
+    duration = len(audio) / whisper.audio.SAMPLE_RATE
+
+    start = time.perf_counter()
+    Audio().warm_up(model_size, backend=backend)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = Audio().transcribe(audio, language, model_size=model_size, backend=backend)
+    transcribe_time = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(json.dumps({
+        "backend": backend,
+        "duration": duration,
+        "load_time": load_time,
+        "transcribe_time": transcribe_time,
+        "rtf": transcribe_time / duration,
+        "peak_rss_mb": peak_rss_mb,
+        "segments": len(result["segments"])
+    }))
+
+def benchmark(audio_path, language, model_size):
+    if not os.path.exists(audio_path):
+        print(f"No audio file found at {audio_path}. Please extract audio from a video first.")
+        return
+
+    results = []
+    for backend in BACKENDS:
+        print(f"Running {backend}...")
+        process = subprocess.run(
+            [sys.executable, __file__, "--worker", backend, audio_path, language, model_size],
+            capture_output=True, text=True
+        )
+        if process.returncode != 0:
+            print(f"❌ {backend} failed:\n{process.stderr[-2000:]}")
+            continue
+        results.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    print(f"\n{'backend':<22}{'load':>8}{'transcribe':>12}{'RTF':>8}{'peak RSS':>12}{'segments':>10}")
+    for r in results:
+        print(f"{r['backend']:<22}{r['load_time']:>7.1f}s{r['transcribe_time']:>11.1f}s"
+              f"{r['rtf']:>8.3f}{r['peak_rss_mb']:>9.0f} MB{r['segments']:>10}")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        run_backend(*sys.argv[2:6])
+    else:
+        args = sys.argv[1:]
+        audio_path = args[0] if len(args) > 0 else "temp/audio.mp3"
+        language = args[1] if len(args) > 1 else "en"
+        model_size = args[2] if len(args) > 2 else os.getenv("WHISPER_MODEL", "base")
+        benchmark(audio_path, language, model_size)
@@ -5,221 +5,132 @@ import librosa.display
 import numpy as np
 import matplotlib.pyplot as plt
 import soundfile as sf
-import torchaudio as ta
-from chatterbox.tts import ChatterboxTTS
 import os
-import subprocess
 from pydub import AudioSegment
+from .models import model_registry
+
+# Whisper model size used when none is given, e.g. "tiny", "base", "small", "medium"
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
 
 class Audio:
-  def extract_audio(self, video_path):
+  def extract_audio(self, video_path, output_path="temp/audio.mp3"):
     video = VideoFileClip(video_path)
     audio = video.audio
-    audio.write_audiofile("temp/audio.mp3")
+    audio.write_audiofile(output_path)
     
-    return "temp/audio.mp3"
+    return output_path
+
+  def extract_pcm(self, video_path, output_dir="temp/pcm"):
+    """Decode the soundtrack once into a PCMStore of lossless float32 buffers"""
+    from .pcm_store import PCMStore
+    return PCMStore(output_dir).extract(video_path)
   
-  def transcribe(self, audio_path, language="en"):
-    audio = whisper.load_audio(audio_path)
-    model = whisper.load_model("base")
+  def load_whisper_model(self, model_size=None, device="cpu", compute_type="float32"):
+    """Cached Whisper model for (model size, device, compute type), loaded on first use"""
+    model_size = model_size or WHISPER_MODEL
+
+    def load():
+      model = whisper.load_model(model_size, device=device)
+      return model.half() if compute_type == "float16" else model
+
+    return model_registry.get(("whisper", model_size, device, compute_type), load)
+
+  def warm_up(self, model_size=None, device="cpu", compute_type=None, backend=None):
+    """Load the transcription model ahead of the first transcription"""
+    from .transcription import get_backend
+    get_backend(backend, model_size, device, compute_type).warm_up()
+
+  def transcribe(self, audio_path, language="en", model_size=None, device="cpu", compute_type=None,
+                 workers=1, chunk_seconds=300, backend=None, word_timestamps=False):
+    """
+    Transcribe a file path or a 16 kHz float32 array with the given backend
+    (TRANSCRIPTION_BACKEND by default). With workers > 1, audio longer than two
+    chunks is split on silence and transcribed in a process pool.
+
+    Word-level timing is only computed when word_timestamps is set; by default
+    segments carry start/end/text only.
+    """
+    from .transcription import get_backend, transcribe_long_form
+
+    audio = whisper.load_audio(audio_path) if isinstance(audio_path, str) else audio_path
+
+    if workers > 1 and len(audio) > 2 * chunk_seconds * whisper.audio.SAMPLE_RATE:
+      return transcribe_long_form(audio, language, model_size, chunk_seconds, workers, backend, word_timestamps)
 
-    result = whisper.transcribe(model, audio, language=language)
+    result = get_backend(backend, model_size, device, compute_type).transcribe(audio, language, word_timestamps)
 
     # print(json.dumps(result, indent = 2, ensure_ascii = False))
     return result
   
-  def separate_audio_with_demucs(self, audio_path):
+  def separate_audio_with_demucs(self, audio_path, sample_rate=None):
     """
     Separate audio using Demucs (modern, state-of-the-art source separation)
+    Takes a file path, or a float32 (frames, channels) buffer at sample_rate.
     Returns paths to vocals and instrumental tracks
     """
+    from .separation import DemucsSeparator
+
     try:
-      # Create output directory if it doesn't exist
-      os.makedirs("temp/demucs_output", exist_ok=True)
-      
-      # Run demucs separation
-      cmd = [
-        "python", "-m", "demucs.separate",
-        "--two-stems=vocals",  # Separate into vocals and accompaniment
-        "-o", "temp/demucs_output",
-        audio_path
-      ]
-      
-      subprocess.run(cmd, check=True, capture_output=True)
-      
-      # Find the output files (demucs creates subdirectories)
-      audio_name = os.path.splitext(os.path.basename(audio_path))[0]
-      base_dir = f"temp/demucs_output/mdx_extra/{audio_name}"
-      
-      vocals_path = f"{base_dir}/vocals.wav"
-      instrumental_path = f"{base_dir}/no_vocals.wav"
-      
-      # Copy to temp directory with standard names
-      if os.path.exists(vocals_path):
-        subprocess.run(["cp", vocals_path, "temp/vocals_demucs.wav"], check=True)
-      if os.path.exists(instrumental_path):
-        subprocess.run(["cp", instrumental_path, "temp/instrumental_demucs.wav"], check=True)
-      
-      return "temp/demucs_output/htdemucs/audio/vocals.wav", "temp/demucs_output/htdemucs/audio/no_vocals.wav"
-      
-    except subprocess.CalledProcessError as e:
-      print(f"Demucs separation failed: {e}")
-      # Fallback to librosa method
-      return self.separate_audio_from_music(audio_path)
+      separator = DemucsSeparator()
+      if isinstance(audio_path, str):
+        return separator.separate_file(audio_path)
+      return separator.separate(audio_path, sample_rate)
     except Exception as e:
       print(f"Error in Demucs separation: {e}")
       # Fallback to librosa method
+      if not isinstance(audio_path, str):
+        os.makedirs("temp", exist_ok=True)
+        sf.write("temp/separation_input.wav", audio_path, sample_rate, subtype='FLOAT')
+        audio_path = "temp/separation_input.wav"
       return self.separate_audio_from_music(audio_path)
 
-  def separate_audio_from_music(self, audio_path):
-    y, sr = librosa.load(audio_path, sr=44100)
-    
-    # Method 1: Harmonic-Percussive Source Separation + center extraction
-    y_harmonic, y_percussive = librosa.effects.hpss(y, margin=(1.0, 5.0))
-    
-    # Extract center channel (where vocals typically sit in stereo mix)
-    if len(y.shape) > 1:  # if stereo
-        y_center = y[0] - y[1]  # simple center extraction
-    else:
-        y_center = y
-    
-    # Create spectrograms
-    S_full = librosa.stft(y_center, hop_length=512)
-    S_harmonic = librosa.stft(y_harmonic, hop_length=512)
-    
-    # Improved separation using multiple techniques
-    
-    # 1. Median filtering for repetitive background removal
-    S_filter = librosa.decompose.nn_filter(np.abs(S_full), 
-                                          aggregate=np.median, 
-                                          metric='cosine',
-                                          width=int(sr/512))  # adaptive window
-    
-    # 2. Conservative margins - preserve more music
-    freq_bins = librosa.fft_frequencies(sr=sr, n_fft=2048)
-    vocal_range = (freq_bins >= 200) & (freq_bins <= 800)  # narrower vocal range
-    
-    # More conservative margins to preserve instruments
-    margin_v = np.ones_like(freq_bins) * 1.5  # less aggressive vocal extraction
-    margin_i = np.ones_like(freq_bins) * 0.3  # much more conservative instrument removal
-    
-    # Only slightly boost core vocal frequencies
-    margin_v[vocal_range] = 2.5
-    margin_i[vocal_range] = 0.5  # preserve instruments even in vocal range
-    
-    # 3. Gentler masking to preserve more instruments
-    S_abs = np.abs(S_full)
-    S_diff = np.maximum(0, S_abs - S_filter * 0.5)  # less aggressive filtering
-    
-    # Create masks with frequency-dependent margins
-    mask_v = librosa.util.softmask(S_diff, 
-                                  margin_i[:, np.newaxis] * S_filter, 
-                                  power=1.5)  # gentler power
-    mask_i = librosa.util.softmask(S_filter, 
-                                  margin_v[:, np.newaxis] * S_diff, 
-                                  power=1.5)
-    
-    # Ensure instrumental track retains most of the original
-    mask_i = np.maximum(mask_i, 0.2)  # always keep at least 20% of original
-    
-    # 4. Apply temporal smoothing to reduce artifacts
-    from scipy.ndimage import median_filter
-    mask_v = median_filter(mask_v, size=(1, 3))  # smooth in time
-    mask_i = median_filter(mask_i, size=(1, 3))
-    
-    # Apply masks
-    S_foreground = mask_v * S_full
-    S_background = mask_i * S_full
-    
-    # Convert back to audio with overlap-add
-    y_foreground = librosa.istft(S_foreground, hop_length=512)
-    y_background = librosa.istft(S_background, hop_length=512)
-    
-    # Post-processing: preserve low frequencies for instruments
-    y_foreground = librosa.effects.preemphasis(y_foreground)  # emphasize high freq for vocals
-    
-    # Add back some low-end to instrumental track
-    y_background_lowpass = librosa.effects.preemphasis(y_background, coef=-0.97)  # boost low freq
-    
-    # Normalize to prevent clipping
-    y_foreground = y_foreground / (np.max(np.abs(y_foreground)) + 1e-8)
-    y_background_lowpass = y_background_lowpass / (np.max(np.abs(y_background_lowpass)) + 1e-8)
-    
-    # Save with higher quality
-    sf.write('temp/vocals.wav', y_foreground, sr, subtype='PCM_24')
-    sf.write('temp/instrumental.wav', y_background_lowpass, sr, subtype='PCM_24')
-    
-    return "temp/demucs_output/htdemucs/audio/vocals.wav", "temp/demucs_output/htdemucs/audio/no_vocals.wav"
+  def separate_audio_from_music(self, audio_path, block_seconds=30, overlap_seconds=2):
+    """
+    Repetition-based spectral separation (nn_filter + soft masks), processed in
+    overlapping blocks so memory stays constant in the length of the file.
+    Clips shorter than block_seconds are separated in a single block.
+    """
+    from .separation import separate_spectral
+
+    os.makedirs("temp", exist_ok=True)
+    return separate_spectral(audio_path, "temp/vocals.wav", "temp/instrumental.wav",
+                             block_seconds=block_seconds, overlap_seconds=overlap_seconds)
 
 # Alternative method focusing on center-channel extraction
-  def separate_vocals_center_extraction(self, audio_path):
-      """Simpler approach focusing on stereo center extraction"""
-      y, sr = librosa.load(audio_path, mono=False)
-      
-      if y.shape[0] == 2:  # stereo
-          # Center extraction (vocals) and sides (instruments)
-          center = (y[0] + y[1]) / 2
-          sides = (y[0] - y[1]) / 2
-          
-          # Enhance separation with spectral gating
-          S_center = librosa.stft(center)
-          S_sides = librosa.stft(sides)
-          
-          # Simple spectral gating
-          magnitude_center = np.abs(S_center)
-          magnitude_sides = np.abs(S_sides)
-          
-          # Create masks based on which channel is dominant
-          mask_vocals = magnitude_center > (magnitude_sides * 1.5)
-          mask_instruments = magnitude_sides > (magnitude_center * 0.8)
-          
-          # Apply masks
-          vocals = librosa.istft(S_center * mask_vocals)
-          instruments = librosa.istft(S_sides * mask_instruments + S_center * ~mask_vocals)
-          
-      else:  # mono - fall back to spectral method
+  def separate_vocals_center_extraction(self, audio_path, workers=1, block_seconds=30):
+      """
+      Simpler approach focusing on stereo center extraction, streamed in blocks at the
+      file's native sample rate. workers > 1 splits long files across a process pool.
+      """
+      from .separation import separate_center
+
+      os.makedirs("temp", exist_ok=True)
+      try:
+          channels = sf.info(audio_path).channels
+      except RuntimeError:
+          # Formats soundfile can't stream are decoded once to a float WAV
+          y, sr = librosa.load(audio_path, sr=None, mono=False)
+          audio_path = os.path.join("temp", "center_input.wav")
+          sf.write(audio_path, np.atleast_2d(y).T, sr, subtype='FLOAT')
+          channels = np.atleast_2d(y).shape[0]
+
+      if channels != 2:  # mono - fall back to spectral method
           vocals, instruments = self.separate_audio_from_music(audio_path)
           return vocals, instruments
-    
-      # Normalize and save
-      vocals = vocals / (np.max(np.abs(vocals)) + 1e-8)
-      instruments = instruments / (np.max(np.abs(instruments)) + 1e-8)
-      
-      sf.write('temp/vocals_center.wav', vocals, sr)
-      sf.write('temp/instrumental_center.wav', instruments, sr)
-      
-      return "temp/vocals_center.wav", "temp/instrumental_center.wav"
+
+      return separate_center(audio_path, "temp/vocals_center.wav", "temp/instrumental_center.wav",
+                             block_seconds=block_seconds, workers=workers)
 
   def convert_mp3_to_wav(self, audio_path):
     audio_path = os.path.realpath(audio_path)
+    wav_path = os.path.splitext(audio_path)[0] + ".wav"
     audio = AudioSegment.from_mp3(audio_path)
-    audio.export("temp/audio.wav", format="wav")
-    return "temp/audio.wav"
+    audio.export(wav_path, format="wav")
+    return wav_path
 
   def generate_translated_audio(self, audio_path, translation_text, output_path):
-    import torch
+    """One-shot generation; use core.tts.TTSEngine directly when generating many lines"""
+    from .tts import TTSEngine
 
-    if not os.path.exists(audio_path):
-      raise FileNotFoundError(f"Audio file not found: {audio_path}")
-    
-    if audio_path.endswith(".mp3"):
-      audio_path = self.convert_mp3_to_wav(audio_path)
-
-    # Monkey patch torch.load to force CPU loading
-    original_load = torch.load
-    def cpu_load(*args, **kwargs):
-        kwargs['map_location'] = torch.device('cpu')
-        return original_load(*args, **kwargs)
-    
-    torch.load = cpu_load
-    
-    try:
-        model = ChatterboxTTS.from_pretrained(device="cpu")
-        text = translation_text
-        wav = model.generate(text, audio_prompt_path=audio_path)
-        ta.save(output_path, wav, model.sr)
-
-        return output_path
-    finally:
-        # Restore original torch.load
-        torch.load = original_load
\ No newline at end of file
+    with TTSEngine(audio_path) as engine:
+      return engine.generate(translation_text, output_path)
\ No newline at end of file
@@ -3,6 +3,14 @@ import re
 import subprocess
 from pathlib import Path
 import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import soundfile as sf
+from scipy.signal import lfilter, resample_poly
+from scipy.ndimage import maximum_filter1d
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
 
 def parse_srt_file(srt_path):
     """Parse SRT file and return list of subtitle entries with timing info."""
@@ -46,92 +54,108 @@ def srt_time_to_seconds(time_str):
     seconds = float(parts[2])
     return hours * 3600 + minutes * 60 + seconds
 
-def get_audio_volume_rms(audio_file):
-    """Get the RMS volume level of an audio file using FFmpeg with more accurate detection."""
-    try:
-        cmd = [
-            'ffmpeg',
-            '-i', audio_file,
-            '-af', 'astats=metadata=1:reset=1',
-            '-f', 'null',
-            '-',
-            '-v', 'error'  # Reduce verbosity
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        # Parse the RMS level from FFmpeg stderr output
-        output = result.stderr
-        rms_values = []
-        
-        for line in output.split('\n'):
-            if 'RMS level dB:' in line:
-                # Extract the dB value
-                try:
-                    db_value = float(line.split('RMS level dB:')[1].strip())
-                    rms_values.append(db_value)
-                except (ValueError, IndexError):
-                    continue
-        
-        if rms_values:
-            # Return average RMS if multiple channels
-            return sum(rms_values) / len(rms_values)
-        
-        # Fallback to volumedetect if astats fails
-        return get_audio_volume_fallback(audio_file)
-        
-    except Exception as e:
-        print(f"Warning: Could not detect volume for {audio_file}: {e}")
-        return get_audio_volume_fallback(audio_file)
+def _biquad_high_shelf(sample_rate, gain_db=3.999843853973347, q=0.7071752369554196, fc=1681.974450955533):
+    """K-weighting pre-filter (BS.1770 stage 1), in De Man's form that yields the ITU coefficients at 48 kHz."""
+    k = math.tan(math.pi * fc / sample_rate)
+    vh = 10 ** (gain_db / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    b = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]
+    a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array(b), np.array(a)
 
-def get_audio_volume_fallback(audio_file):
-    """Fallback volume detection using volumedetect."""
-    try:
-        cmd = [
-            'ffmpeg',
-            '-i', audio_file,
-            '-af', 'volumedetect',
-            '-f', 'null',
-            '-',
-            '-v', 'info'
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        output = result.stderr
-        
-        # Look for mean_volume first (most accurate)
-        for line in output.split('\n'):
-            if 'mean_volume:' in line:
-                db_value = float(line.split('mean_volume:')[1].split('dB')[0].strip())
-                return db_value
-        
-        # If mean_volume not found, look for max_volume
-        for line in output.split('\n'):
-            if 'max_volume:' in line:
-                db_value = float(line.split('max_volume:')[1].split('dB')[0].strip())
-                return db_value - 6  # Rough estimate of mean from max
-        
-        return -20  # Default fallback
-    except Exception:
-        return -20
+def _biquad_high_pass(sample_rate, q=0.5003270373238773, fc=38.13547087602444):
+    """RLB high-pass (BS.1770 stage 2), in De Man's form."""
+    k = math.tan(math.pi * fc / sample_rate)
+    a0 = 1 + k / q + k * k
+    b = [1.0, -2.0, 1.0]
+    a = [1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array(b), np.array(a)
+
+def integrated_loudness(samples, sample_rate=SAMPLE_RATE):
+    """EBU R128 / ITU-R BS.1770 integrated loudness (LUFS) of a (frames, channels) array."""
+    # K-weighting
+    weighted = samples
+    for b, a in (_biquad_high_shelf(sample_rate), _biquad_high_pass(sample_rate)):
+        weighted = lfilter(b, a, weighted, axis=0)
+
+    # Mean square over 400 ms blocks with 75% overlap, computed from a cumulative sum
+    block = int(0.4 * sample_rate)
+    step = int(0.1 * sample_rate)
+    if len(weighted) < block:
+        block_power = np.mean(weighted ** 2, axis=0, keepdims=True)
+    else:
+        cumulative = np.concatenate([np.zeros((1, weighted.shape[1])), np.cumsum(weighted ** 2, axis=0)])
+        starts = np.arange(0, len(weighted) - block + 1, step)
+        block_power = (cumulative[starts + block] - cumulative[starts]) / block
+
+    block_power = block_power.sum(axis=1)
+    block_loudness = -0.691 + 10 * np.log10(np.maximum(block_power, 1e-12))
+
+    # Absolute gate at -70 LUFS, then relative gate 10 LU below the absolute-gated level
+    gated = block_power[block_loudness > -70]
+    if len(gated) == 0:
+        return float('-inf')
+    relative_gate = -0.691 + 10 * math.log10(gated.mean()) - 10
+    gated = block_power[(block_loudness > -70) & (block_loudness > relative_gate)]
+    if len(gated) == 0:
+        return float('-inf')
+    return -0.691 + 10 * math.log10(gated.mean())
+
+def measure_loudness(samples, sample_rate=SAMPLE_RATE):
+    """Return RMS level (dB, averaged over channels like astats), peak level (dB) and integrated loudness (LUFS)."""
+    if len(samples) == 0:
+        return {'rms_db': float('-inf'), 'peak_db': float('-inf'), 'lufs': float('-inf')}
+
+    with np.errstate(divide='ignore'):
+        channel_rms_db = 20 * np.log10(np.sqrt(np.mean(np.square(samples, dtype=np.float64), axis=0)))
+        peak_db = 20 * np.log10(np.max(np.abs(samples)))
+
+    return {
+        'rms_db': float(np.mean(channel_rms_db)),
+        'peak_db': float(peak_db),
+        'lufs': integrated_loudness(samples, sample_rate)
+    }
+
+def analyze_loudness(audio_files, clips=None, sample_rate=SAMPLE_RATE, max_workers=None):
+    """
+    Measure every clip in memory on a thread pool (NumPy and libsndfile release the GIL).
+
+    Args:
+        audio_files: List of audio file paths
+        clips: Optional already-decoded clips (same order as audio_files), skips decoding
+    """
+    def analyze(i):
+        samples = clips[i] if clips is not None else decode_audio(audio_files[i], sample_rate)
+        return measure_loudness(samples, sample_rate)
 
-def calculate_volume_adjustments(audio_files, target_db=-12, use_peak_normalization=False):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(analyze, range(len(audio_files))))
+
+def calculate_volume_adjustments(audio_files, target_db=-12, use_peak_normalization=False,
+                                 use_loudness_normalization=False, clips=None, sample_rate=SAMPLE_RATE):
     """
     Calculate volume adjustments to normalize all audio files to the same level.
     
     Args:
         audio_files: List of audio file paths
-        target_db: Target dB level (default -12 dB for good headroom)
+        target_db: Target dB level (default -12 dB for good headroom), LUFS with loudness normalization
         use_peak_normalization: If True, normalize to peak level instead of RMS
+        use_loudness_normalization: If True, normalize to EBU R128 integrated loudness instead of RMS
+        clips: Optional already-decoded clips, so the files are not read again
     """
     print("Analyzing audio volumes...")
     volumes = {}
     
-    for i, audio_file in enumerate(audio_files):
+    for i, loudness in enumerate(analyze_loudness(audio_files, clips, sample_rate)):
         if use_peak_normalization:
-            current_db = get_peak_volume(audio_file)
+            current_db = loudness['peak_db']
             print(f"Track {i}: {current_db:.1f} dB (peak)")
+        elif use_loudness_normalization:
+            current_db = loudness['lufs']
+            print(f"Track {i}: {current_db:.1f} LUFS")
         else:
-            current_db = get_audio_volume_rms(audio_file)
+            current_db = loudness['rms_db']
             print(f"Track {i}: {current_db:.1f} dB (RMS)")
         
         volumes[i] = current_db
@@ -162,28 +186,70 @@ def calculate_volume_adjustments(audio_files, target_db=-12, use_peak_normalizat
     
     return adjustments
 
-def get_peak_volume(audio_file):
-    """Get the peak volume level of an audio file."""
+def decode_audio(audio_file, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """Decode an audio file into a float32 (frames, channels) array at the given sample rate."""
     try:
-        cmd = [
-            'ffmpeg',
-            '-i', audio_file,
-            '-af', 'volumedetect',
-            '-f', 'null',
-            '-',
-            '-v', 'info'
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        output = result.stderr
-        for line in output.split('\n'):
-            if 'max_volume:' in line:
-                db_value = float(line.split('max_volume:')[1].split('dB')[0].strip())
-                return db_value
-        
-        return -20  # Default fallback
-    except Exception:
-        return -20
+        samples, file_rate = sf.read(audio_file, dtype='float32', always_2d=True)
+    except RuntimeError:
+        # Formats libsndfile can't read (e.g. some MP3s) go through FFmpeg
+        return decode_audio_ffmpeg(audio_file, sample_rate, channels)
+
+    if file_rate != sample_rate:
+        divisor = math.gcd(file_rate, sample_rate)
+        samples = resample_poly(samples, sample_rate // divisor, file_rate // divisor, axis=0).astype(np.float32)
+
+    if samples.shape[1] == channels:
+        return samples
+    if channels == 1:
+        return samples.mean(axis=1, keepdims=True)
+    if samples.shape[1] == 1:
+        return np.repeat(samples, channels, axis=1)
+    return np.ascontiguousarray(samples[:, :channels])
+
+def decode_audio_ffmpeg(audio_file, sample_rate=SAMPLE_RATE, channels=CHANNELS):
+    """Decode any FFmpeg-readable file into a float32 (frames, channels) array."""
+    cmd = [
+        'ffmpeg',
+        '-v', 'error',
+        '-i', audio_file,
+        '-f', 'f32le',
+        '-ac', str(channels),
+        '-ar', str(sample_rate),
+        '-'
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels).copy()
+
+def apply_compressor(samples, sample_rate=SAMPLE_RATE, threshold_db=-18, ratio=3, attack_ms=3, release_ms=50, makeup_db=2):
+    """
+    Vectorized approximation of FFmpeg's acompressor (RMS detection, linked channels).
+
+    The envelope is a peak-hold over the attack window combined with a one-pole
+    release, so the whole clip is processed without a per-sample Python loop.
+    Modifies samples in place and returns it.
+    """
+    power = np.mean(samples ** 2, axis=1)
+    attack_frames = max(1, int(sample_rate * attack_ms / 1000))
+    held = maximum_filter1d(power, size=attack_frames)
+
+    release_coef = math.exp(-1.0 / (sample_rate * release_ms / 1000))
+    smoothed = lfilter([1 - release_coef], [1, -release_coef], held)
+    envelope = np.maximum(held, smoothed)
+
+    envelope_db = 10 * np.log10(np.maximum(envelope, 1e-12))
+    over_db = np.maximum(envelope_db - threshold_db, 0)
+    gain = 10 ** ((makeup_db - over_db * (1 - 1 / ratio)) / 20)
+
+    samples *= gain[:, np.newaxis].astype(np.float32)
+    return samples
+
+def load_background_track(background_music_path, total_frames, sample_rate=SAMPLE_RATE):
+    """Decode the background track and loop/trim it to exactly total_frames."""
+    background = decode_audio(background_music_path, sample_rate)
+    if len(background) == 0:
+        return np.zeros((total_frames, CHANNELS), dtype=np.float32)
+    repeats = -(-total_frames // len(background))
+    return np.tile(background, (repeats, 1))[:total_frames]
 
 def get_audio_files(folder_path):
     """Get all translated_audio_*.wav files from the folder."""
@@ -202,21 +268,17 @@ def get_audio_files(folder_path):
     audio_files.sort(key=lambda x: x[0])
     return [file_path for _, file_path in audio_files]
 
-def combine_audio_with_timing(audio_folder, srt_path, background_music_path=None, output_path="final_output.wav", 
-                            auto_normalize=True, target_volume_db=-12, use_peak_normalization=False, 
-                            use_compressor=True):
+def mix_dub_track(audio_folder, srt_path, background_music_path=None,
+                  auto_normalize=True, target_volume_db=-12, use_peak_normalization=False,
+                  use_compressor=True, sample_rate=SAMPLE_RATE, use_loudness_normalization=False):
     """
-    Combine audio files according to SRT timing and optionally add background music.
-    
-    Args:
-        audio_folder: Path to folder containing translated_audio_*.wav files
-        srt_path: Path to SRT file with timing information
-        background_music_path: Optional path to background music file
-        output_path: Output file path
-        auto_normalize: Whether to automatically normalize all audio to the same volume level
-        target_volume_db: Target volume level in dB (default -12 for good headroom)
-        use_peak_normalization: Use peak instead of RMS normalization
-        use_compressor: Apply audio compression for more consistent levels
+    Mix the dubbed clips onto one float32 timeline at their SRT offsets.
+
+    Every clip is decoded once, gain and compression are applied as array
+    operations and the result is summed into a single preallocated buffer,
+    with the background track laid underneath.
+
+    Returns a (frames, 2) float32 array at sample_rate.
     """
     
     # Parse SRT file
@@ -236,100 +298,85 @@ def combine_audio_with_timing(audio_folder, srt_path, background_music_path=None
     print(f"Found {len(audio_files)} audio files")
     print(f"Found {len(subtitles)} subtitle entries")
     
+    # Decode every clip once; the same arrays feed analysis and mixing
+    with ThreadPoolExecutor() as executor:
+        clips = list(executor.map(lambda audio_file: decode_audio(audio_file, sample_rate), audio_files))
+    
     # Get volume adjustments
     if auto_normalize:
         print(f"Auto-normalizing audio volumes to {target_volume_db} dB...")
         volume_adjustments = calculate_volume_adjustments(
             audio_files, 
             target_db=target_volume_db,
-            use_peak_normalization=use_peak_normalization
+            use_peak_normalization=use_peak_normalization,
+            use_loudness_normalization=use_loudness_normalization,
+            clips=clips,
+            sample_rate=sample_rate
         )
     else:
         volume_adjustments = None
     
-    # Create FFmpeg filter complex for combining audio at specific times
-    filter_parts = []
-    input_args = []
-    
-    # Add all audio files as inputs
-    for i, audio_file in enumerate(audio_files):
-        input_args.extend(['-i', audio_file])
-    
-    # Add background music if provided
-    music_input_index = len(audio_files)
-    if background_music_path:
-        input_args.extend(['-i', background_music_path])
+    # Clip offsets use the same millisecond resolution as the old adelay filter
+    offsets = [int(subtitle['start'] * 1000) * sample_rate // 1000 for subtitle in subtitles[:len(clips)]]
     
-    # Create silence base track
-    filter_parts.append(f"aevalsrc=0:duration={total_duration}:sample_rate=44100:channel_layout=stereo[silence]")
+    # Preallocate the timeline; clips running past the last subtitle extend it
+    total_frames = int(round(total_duration * sample_rate))
+    timeline_frames = max([total_frames] + [offset + len(clip) for offset, clip in zip(offsets, clips)])
+    timeline = np.zeros((timeline_frames, CHANNELS), dtype=np.float32)
     
-    # Overlay each audio file at its specific time with volume normalization and optional compression
-    current_mix = "silence"
-    for i, (audio_file, subtitle) in enumerate(zip(audio_files, subtitles)):
-        delay_ms = int(subtitle['start'] * 1000)  # Convert to milliseconds
-        
+    for i, (clip, offset) in enumerate(zip(clips, offsets)):
         # Determine volume for this track
         if volume_adjustments and i in volume_adjustments:
-            volume = volume_adjustments[i]
-        else:
-            volume = 1.0  # Default volume (no change)
-        
-        # Build filter chain for this track
-        filter_chain = f"[{i}]"
-        
-        # Add volume adjustment
-        filter_chain += f"volume={volume}"
+            clip *= np.float32(volume_adjustments[i])
         
-        # Add compressor for more consistent levels (optional)
+        # Gentle compression: threshold=-18dB, ratio=3:1, attack=3ms, release=50ms
         if use_compressor:
-            # Gentle compression: threshold=-18dB, ratio=3:1, attack=3ms, release=50ms
-            filter_chain += ",acompressor=threshold=-18dB:ratio=3:attack=3:release=50:makeup=2dB"
-        
-        # Add delay
-        filter_chain += f",adelay={delay_ms}|{delay_ms}[delayed{i}]"
-        
-        filter_parts.append(filter_chain)
+            apply_compressor(clip, sample_rate)
         
-        # Mix with previous result
-        filter_parts.append(f"[{current_mix}][delayed{i}]amix=inputs=2:duration=longest:normalize=0[mix{i}]")
-        current_mix = f"mix{i}"
+        timeline[offset:offset + len(clip)] += clip
     
     # Add background music if provided
     if background_music_path:
-        # Loop the background music to match total duration
-        filter_parts.append(f"[{music_input_index}]aloop=loop=-1:size=2e+09[bgloop]")
-        filter_parts.append(f"[bgloop]atrim=duration={total_duration}[bg]")
+        background = load_background_track(background_music_path, total_frames, sample_rate)
         
-        # Mix background music with the voice track (keep voice prominent)
-        filter_parts.append(f"[bg]volume=3[bg_quiet]")  # Very quiet background music
-        filter_parts.append(f"[{current_mix}][bg_quiet]amix=inputs=2:duration=longest:weights=1 0.3[final]")
-        output_map = "[final]"
-    else:
-        output_map = f"[{current_mix}]"
-    
-    # Combine all filter parts
-    filter_complex = ";".join(filter_parts)
-    
-    # Build FFmpeg command
-    cmd = [
-        'ffmpeg',
-        '-y',  # Overwrite output file
-    ] + input_args + [
-        '-filter_complex', filter_complex,
-        '-map', output_map,
-        '-c:a', 'pcm_s16le',  # Use WAV format
-        '-ar', '44100',  # Sample rate
-        output_path
-    ]
+        # Same balance as the old "volume=3" + "amix weights=1 0.3" graph (amix normalizes by the weight sum)
+        timeline *= np.float32(1 / 1.3)
+        timeline[:total_frames] += background * np.float32(3 * 0.3 / 1.3)
     
-    print("Running FFmpeg command...")
-    print(" ".join(cmd))
+    return timeline
+
+def combine_audio_with_timing(audio_folder, srt_path, background_music_path=None, output_path="final_output.wav", 
+                            auto_normalize=True, target_volume_db=-12, use_peak_normalization=False, 
+                            use_compressor=True, use_loudness_normalization=False):
+    """
+    Combine audio files according to SRT timing and optionally add background music.
     
+    Args:
+        audio_folder: Path to folder containing translated_audio_*.wav files
+        srt_path: Path to SRT file with timing information
+        background_music_path: Optional path to background music file
+        output_path: Output file path
+        auto_normalize: Whether to automatically normalize all audio to the same volume level
+        target_volume_db: Target volume level in dB (default -12 for good headroom)
+        use_peak_normalization: Use peak instead of RMS normalization
+        use_compressor: Apply audio compression for more consistent levels
+        use_loudness_normalization: Normalize to EBU R128 integrated loudness (target_volume_db in LUFS)
+    """
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        timeline = mix_dub_track(
+            audio_folder, srt_path, background_music_path,
+            auto_normalize=auto_normalize,
+            target_volume_db=target_volume_db,
+            use_peak_normalization=use_peak_normalization,
+            use_compressor=use_compressor,
+            use_loudness_normalization=use_loudness_normalization
+        )
+        
+        # 16-bit PCM WAV, clipped like FFmpeg's float -> s16 conversion
+        np.clip(timeline, -1.0, 1.0, out=timeline)
+        sf.write(output_path, timeline, SAMPLE_RATE, subtype='PCM_16')
         print(f"Successfully created: {output_path}")
         return output_path
-    except subprocess.CalledProcessError as e:
-        print(f"FFmpeg error: {e}")
-        print(f"Error output: {e.stderr}")
+    except (RuntimeError, OSError, subprocess.CalledProcessError) as e:
+        print(f"Audio mixing error: {e}")
         return None
\ No newline at end of file
@@ -6,7 +6,7 @@ class Export:
     with open(file_path, "w") as f:
       f.write(result)
 
-  def generate_srt(self, result):
+  def generate_srt(self, result, output_path="temp/result.srt"):
     def format_timestamp(seconds):
         """Convert seconds to SRT timestamp format (HH:MM:SS,mmm)"""
         hours = int(seconds // 3600)
@@ -33,7 +33,7 @@ class Export:
     output = "\n".join(srt_lines)
     
     # Use absolute path to avoid path resolution issues
-    srt_path = os.path.abspath("temp/result.srt")
+    srt_path = os.path.abspath(output_path)
     self.save_to_file(output, srt_path)
     
     return srt_path
@@ -1,11 +1,98 @@
 import os
-from openai import OpenAI
+import time
+import random
+import asyncio
+import tiktoken
+from openai import AsyncOpenAI, APIConnectionError, APIStatusError
+
+_encodings = {}
+
+def get_encoding(model=None):
+  """tiktoken encoding for an OpenRouter model id, o200k_base when the model is unknown"""
+  if model not in _encodings:
+    try:
+      try:
+        _encodings[model] = tiktoken.encoding_for_model((model or "").split("/")[-1])
+      except KeyError:
+        _encodings[model] = tiktoken.get_encoding("o200k_base")
+    except Exception:
+      # BPE files can't be fetched (e.g. offline); fall back to a character estimate
+      _encodings[model] = None
+  return _encodings[model]
+
+def count_tokens(text, model=None):
+  encoding = get_encoding(model)
+  if encoding is None:
+    return len(text) // 4 + 1
+  return len(encoding.encode(text, disallowed_special=()))
+
+class TokenBucket:
+  """Async token bucket refilled continuously at `per_minute` units per minute"""
+  def __init__(self, per_minute):
+    self.capacity = per_minute
+    self.tokens = per_minute
+    self.rate = per_minute / 60
+    self.updated = time.monotonic()
+    self.lock = asyncio.Lock()
+
+  async def acquire(self, amount=1):
+    # A single request larger than the bucket would otherwise wait forever
+    amount = min(amount, self.capacity)
+    async with self.lock:
+      while True:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= amount:
+          self.tokens -= amount
+          return
+        await asyncio.sleep((amount - self.tokens) / self.rate)
 
 class LLM:
-  def __init__(self):
-    self.client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=os.getenv('OPENROUTER_API_KEY'))
+  """
+  Async OpenRouter client shared by concurrent translation batches.
+
+  Requests are bounded by an in-flight limit and by requests-per-minute and
+  tokens-per-minute buckets; 429/5xx responses and connection errors are
+  retried with jittered exponential backoff.
+  """
+  def __init__(self, max_in_flight=None, requests_per_minute=None, tokens_per_minute=None, max_retries=5, base_url=None):
+    # Retries are handled here so they go through the rate limiter too
+    self.client = AsyncOpenAI(base_url=base_url or os.getenv('OPENROUTER_BASE_URL', "https://openrouter.ai/api/v1"),
+                              api_key=os.getenv('OPENROUTER_API_KEY'), max_retries=0)
+    self.max_in_flight = max_in_flight or int(os.getenv('OPENROUTER_MAX_IN_FLIGHT', '4'))
+    self.in_flight = asyncio.Semaphore(self.max_in_flight)
+    self.request_bucket = TokenBucket(requests_per_minute or int(os.getenv('OPENROUTER_RPM', '60')))
+    self.token_bucket = TokenBucket(tokens_per_minute or int(os.getenv('OPENROUTER_TPM', '200000')))
+    self.max_retries = max_retries
+
+  def estimate_tokens(self, messages, model=None):
+    # Prompt tokens plus a completion about as long as the prompt
+    return 2 * sum(count_tokens(message['content'], model) for message in messages)
+
+  def retry_delay(self, attempt, error):
+    retry_after = None
+    if isinstance(error, APIStatusError):
+      retry_after = error.response.headers.get('retry-after')
+    try:
+      return float(retry_after)
+    except (TypeError, ValueError):
+      return min(30, 2 ** attempt) * random.uniform(0.5, 1.5)
+
+  async def generate_response(self, messages, model):
+    for attempt in range(self.max_retries + 1):
+      try:
+        async with self.in_flight:
+          await self.request_bucket.acquire()
+          await self.token_bucket.acquire(self.estimate_tokens(messages, model))
+          response = await self.client.chat.completions.create(model=model, messages=messages)
+          return response.choices[0].message.content
+      except (APIStatusError, APIConnectionError) as e:
+        retryable = not isinstance(e, APIStatusError) or e.status_code == 429 or e.status_code >= 500
+        if not retryable or attempt == self.max_retries:
+          raise
 
-  def generate_response(self, messages, model):
-    response = self.client.chat.completions.create(model=model, messages=messages)
-    return response.choices[0].message.content
-  
\ No newline at end of file
+        delay = self.retry_delay(attempt, e)
+        print(f"LLM request failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
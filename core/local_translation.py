@@ -0,0 +1,83 @@
+import os
+import threading
+import ctranslate2
+import argostranslate.package
+
+# Loaded translators per (from_code, to_code), kept for the lifetime of the process
+_translators = {}
+_translators_lock = threading.Lock()
+
+class LocalTranslator:
+  """
+  An installed argostranslate package driven directly through CTranslate2.
+
+  Unlike argostranslate.translate, a whole list of subtitle lines goes through a
+  single batched translate_batch call with multi-threaded CPU inference.
+  """
+  def __init__(self, package, inter_threads=None, intra_threads=None):
+    self.package = package
+    self.translator = ctranslate2.Translator(
+      str(package.package_path / "model"),
+      device="cpu",
+      inter_threads=inter_threads or int(os.getenv("LOCAL_TRANSLATION_INTER_THREADS") or 1),
+      intra_threads=intra_threads or int(os.getenv("LOCAL_TRANSLATION_INTRA_THREADS") or os.cpu_count() or 4)
+    )
+
+  def translate(self, texts, beam_size=4, max_batch_size=32):
+    if not texts:
+      return []
+
+    tokenized = [self.package.tokenizer.encode(text) for text in texts]
+    target_prefix = [[self.package.target_prefix]] * len(tokenized) if self.package.target_prefix else None
+
+    results = self.translator.translate_batch(
+      tokenized,
+      target_prefix=target_prefix,
+      replace_unknowns=True,
+      max_batch_size=max_batch_size,
+      beam_size=beam_size,
+      num_hypotheses=1,
+      length_penalty=0.2
+    )
+
+    translations = []
+    for result in results:
+      value = self.package.tokenizer.decode(result.hypotheses[0])
+      if self.package.target_prefix and value.startswith(self.package.target_prefix):
+        value = value[len(self.package.target_prefix):]
+      # The tokenizer adds a leading space
+      translations.append(value.strip())
+    return translations
+
+def find_installed_package(from_code, to_code):
+  for package in argostranslate.package.get_installed_packages():
+    if package.type == "translate" and package.from_code == from_code and package.to_code == to_code:
+      return package
+  return None
+
+def get_local_translators(from_code, to_code):
+  """
+  Cached translators for a language pair: the direct package, or from -> en -> to
+  when only the English pivot packages are installed.
+  """
+  with _translators_lock:
+    if (from_code, to_code) not in _translators:
+      pairs = [(from_code, to_code)]
+      if find_installed_package(from_code, to_code) is None and "en" not in (from_code, to_code):
+        pairs = [(from_code, "en"), ("en", to_code)]
+
+      translators = []
+      for pair in pairs:
+        package = find_installed_package(*pair)
+        if package is None:
+          raise ValueError(f"No installed argostranslate package for {pair[0]} -> {pair[1]}, install it with install_languages.py")
+        translators.append(LocalTranslator(package))
+      _translators[(from_code, to_code)] = translators
+
+    return _translators[(from_code, to_code)]
+
+def translate_lines(texts, from_code, to_code):
+  """Translate subtitle lines offline, one batched call per translation step"""
+  for translator in get_local_translators(from_code, to_code):
+    texts = translator.translate(texts)
+  return texts
@@ -0,0 +1,53 @@
+import os
+import threading
+from collections import OrderedDict
+
+def model_size_bytes(model):
+  """Parameter and buffer memory of a torch module, 0 for anything else"""
+  tensors = []
+  if hasattr(model, "parameters"):
+    tensors.extend(model.parameters())
+  if hasattr(model, "buffers"):
+    tensors.extend(model.buffers())
+  return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+class ModelRegistry:
+  """
+  Process-wide cache of loaded models.
+
+  Each key (e.g. ("whisper", size, device, compute_type)) is loaded once and the
+  cached instance is handed out afterwards. When the loaded models exceed the
+  memory budget the least recently used ones are dropped.
+  """
+  def __init__(self, memory_budget=None):
+    self.memory_budget = memory_budget or int(os.getenv("MODEL_MEMORY_BUDGET_MB", "8192")) * 1024 * 1024
+    self.models = OrderedDict()
+    self.lock = threading.Lock()
+
+  def get(self, key, loader, size_fn=model_size_bytes):
+    with self.lock:
+      if key in self.models:
+        self.models.move_to_end(key)
+        return self.models[key][0]
+
+      model = loader()
+      self.models[key] = (model, size_fn(model))
+      self.evict()
+      return model
+
+  def warm_up(self, key, loader, size_fn=model_size_bytes):
+    """Load a model ahead of the first request that needs it"""
+    self.get(key, loader, size_fn)
+
+  def evict(self):
+    # The most recently used model always stays, even if it alone exceeds the budget
+    while len(self.models) > 1 and sum(size for _, size in self.models.values()) > self.memory_budget:
+      key, _ = self.models.popitem(last=False)
+      print(f"Evicting model {key} from the registry")
+
+  def clear(self):
+    with self.lock:
+      self.models.clear()
+
+# Shared by every Audio/TTS/separation instance in this process
+model_registry = ModelRegistry()
@@ -0,0 +1,71 @@
+import os
+import json
+import ffmpeg
+import numpy as np
+import soundfile as sf
+
+# (sample rate, channels) of every buffer extracted from the source:
+# 16 kHz mono for Whisper, 44.1 kHz stereo for separation, mixing and TTS reference audio
+SPEECH_FORMAT = (16000, 1)
+FULL_FORMAT = (44100, 2)
+
+class PCMStore:
+  """
+  Lossless float32 PCM decoded once from the source video.
+
+  {root}/pcm_{rate}_{channels}.f32 holds raw interleaved samples and
+  {root}/meta.json their sample rates, channel counts and frame counts. Buffers
+  are memory-mapped on load, so stages read only the samples they touch.
+  """
+  def __init__(self, root):
+    self.root = root
+    self.meta_path = os.path.join(root, "meta.json")
+    self.meta = {}
+    if os.path.exists(self.meta_path):
+      with open(self.meta_path, "r", encoding="utf-8") as f:
+        self.meta = json.load(f)
+
+  def path(self, sample_rate, channels):
+    return os.path.join(self.root, f"pcm_{sample_rate}_{channels}.f32")
+
+  def extract(self, video_path, formats=(SPEECH_FORMAT, FULL_FORMAT)):
+    """Decode the first audio stream once and resample it into one raw f32le file per format"""
+    os.makedirs(self.root, exist_ok=True)
+    audio = ffmpeg.input(video_path)['a:0']
+    outputs = [
+      ffmpeg.output(audio, self.path(sample_rate, channels), f='f32le', acodec='pcm_f32le', ac=channels, ar=sample_rate)
+      for sample_rate, channels in formats
+    ]
+    ffmpeg.merge_outputs(*outputs).overwrite_output().run(quiet=True)
+
+    self.meta = {}
+    for sample_rate, channels in formats:
+      frames = os.path.getsize(self.path(sample_rate, channels)) // (4 * channels)
+      self.meta[f"{sample_rate}_{channels}"] = {"sample_rate": sample_rate, "channels": channels, "frames": frames}
+    with open(self.meta_path, "w", encoding="utf-8") as f:
+      json.dump(self.meta, f, indent=2)
+    return self
+
+  def info(self, sample_rate, channels):
+    key = f"{sample_rate}_{channels}"
+    if key not in self.meta:
+      raise KeyError(f"No {sample_rate} Hz / {channels} channel buffer in {self.root}")
+    return self.meta[key]
+
+  def duration(self, sample_rate=SPEECH_FORMAT[0], channels=SPEECH_FORMAT[1]):
+    return self.info(sample_rate, channels)["frames"] / sample_rate
+
+  def load(self, sample_rate, channels):
+    """Memory-mapped float32 buffer: (frames,) for mono, (frames, channels) otherwise"""
+    frames = self.info(sample_rate, channels)["frames"]
+    shape = (frames,) if channels == 1 else (frames, channels)
+    # Copy-on-write so consumers that modify their input don't touch the store
+    return np.memmap(self.path(sample_rate, channels), dtype=np.float32, mode='c', shape=shape)
+
+  def write_wav(self, output_path, sample_rate=FULL_FORMAT[0], channels=FULL_FORMAT[1], start=None, end=None):
+    """Write a float WAV of [start, end) seconds for consumers that need a file path"""
+    samples = self.load(sample_rate, channels)
+    start_frame = int((start or 0) * sample_rate)
+    end_frame = len(samples) if end is None else int(end * sample_rate)
+    sf.write(output_path, samples[start_frame:end_frame], sample_rate, subtype='FLOAT')
+    return output_path
@@ -0,0 +1,203 @@
+import os
+import json
+import asyncio
+import hashlib
+import inspect
+
+class ArtifactStore:
+  """
+  Stage outputs keyed by a hash of the stage's inputs and parameters.
+
+  {root}/{stage}/{key}/ is the stage's working directory and manifest.json in it
+  records what the stage produced plus a content hash that downstream keys use.
+  """
+  def __init__(self, root=None):
+    self.root = root or os.getenv("ARTIFACT_DIR", "temp/artifacts")
+    os.makedirs(self.root, exist_ok=True)
+    self.hash_index_path = os.path.join(self.root, "hashes.json")
+    self.hash_index = {}
+    if os.path.exists(self.hash_index_path):
+      with open(self.hash_index_path, "r", encoding="utf-8") as f:
+        self.hash_index = json.load(f)
+    # Entries of deleted files are dropped on load; the index is written by flush_hash_index
+    index_size = len(self.hash_index)
+    self.hash_index = {path: entry for path, entry in self.hash_index.items() if os.path.exists(path)}
+    self.hash_index_dirty = len(self.hash_index) != index_size
+
+  def file_hash(self, path):
+    """sha256 of a file, memoized on (size, mtime) so large sources are only read once"""
+    stat = os.stat(path)
+    abs_path = os.path.abspath(path)
+    cached = self.hash_index.get(abs_path)
+    if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+      return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+      for block in iter(lambda: f.read(1024 * 1024), b""):
+        digest.update(block)
+
+    self.hash_index[abs_path] = [stat.st_size, stat.st_mtime, digest.hexdigest()]
+    self.hash_index_dirty = True
+    return digest.hexdigest()
+
+  def flush_hash_index(self):
+    """Write the hash index if file_hash added entries since the last flush"""
+    if not self.hash_index_dirty:
+      return
+    with open(self.hash_index_path, "w", encoding="utf-8") as f:
+      json.dump(self.hash_index, f)
+    self.hash_index_dirty = False
+
+  def content_hash(self, path):
+    """sha256 of a file, or of every file in a directory (names included)"""
+    if not os.path.isdir(path):
+      file_hash = self.file_hash(path)
+      self.flush_hash_index()
+      return file_hash
+
+    digest = hashlib.sha256()
+    for dir_path, _, file_names in sorted(os.walk(path)):
+      for file_name in sorted(file_names):
+        file_path = os.path.join(dir_path, file_name)
+        digest.update(os.path.relpath(file_path, path).encode("utf-8"))
+        digest.update(self.file_hash(file_path).encode("utf-8"))
+    # One index write per directory instead of one per file
+    self.flush_hash_index()
+    return digest.hexdigest()
+
+  def stage_dir(self, stage, key):
+    return os.path.join(self.root, stage, key)
+
+  def load(self, stage, key):
+    """Return the stage manifest if it exists and every output it lists is still on disk"""
+    manifest_path = os.path.join(self.stage_dir(stage, key), "manifest.json")
+    if not os.path.exists(manifest_path):
+      return None
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+      manifest = json.load(f)
+
+    for path, (size, mtime) in manifest["files"].items():
+      if not os.path.exists(path):
+        return None
+      if not os.path.isdir(path):
+        stat = os.stat(path)
+        if stat.st_size != size or stat.st_mtime != mtime:
+          return None
+    return manifest
+
+  def save(self, stage, key, outputs):
+    paths = list(outputs.values()) if isinstance(outputs, dict) else [outputs]
+    files = {}
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+      stat = os.stat(path)
+      files[path] = [stat.st_size, stat.st_mtime]
+      digest.update(self.content_hash(path).encode("utf-8"))
+
+    manifest = {"outputs": outputs, "files": files, "hash": digest.hexdigest()}
+    with open(os.path.join(self.stage_dir(stage, key), "manifest.json"), "w", encoding="utf-8") as f:
+      json.dump(manifest, f, indent=2)
+    return manifest
+
+class Stage:
+  def __init__(self, name, fn, inputs=None, sources=None, params=None, requires=None):
+    self.name = name
+    self.fn = fn
+    self.inputs = inputs or {}    # argument name -> upstream stage name
+    self.sources = sources or {}  # argument name -> source file path
+    self.params = params or {}
+    self.requires = set(requires or ())  # optional upstream features, e.g. "word_timestamps"
+
+class Pipeline:
+  """
+  Stage graph whose outputs are cached in an ArtifactStore.
+
+  A stage function is called as fn(out_dir, **inputs) and returns the path (or a
+  dict of paths) it produced. Its key is derived from the content hashes of its
+  sources and upstream outputs plus its parameters, so a re-run only executes
+  stages whose inputs or parameters changed. Stages added later may depend on
+  earlier ones; independent async stages run concurrently. A stage can declare
+  optional features it needs from upstream (requires=), which upstream stages
+  check with requires() when the graph is built.
+  """
+  def __init__(self, store=None):
+    self.store = store or ArtifactStore()
+    self.stages = {}
+
+  def add(self, name, fn, inputs=None, sources=None, params=None, requires=None):
+    for upstream in (inputs or {}).values():
+      if upstream not in self.stages:
+        raise ValueError(f"Stage '{name}' depends on unknown stage '{upstream}'")
+    self.stages[name] = Stage(name, fn, inputs, sources, params, requires)
+    return name
+
+  def requires(self, feature):
+    """Whether any stage declared that it needs `feature` from upstream"""
+    return any(feature in stage.requires for stage in self.stages.values())
+
+  def stage_key(self, stage, hashes):
+    payload = json.dumps({
+      "stage": stage.name,
+      "params": stage.params,
+      "sources": {arg: self.store.content_hash(path) for arg, path in stage.sources.items()},
+      "inputs": {arg: hashes[upstream] for arg, upstream in stage.inputs.items()}
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+  def plan(self):
+    """Return [(stage name, status)] with status 'reuse', 'run' or 'run (upstream changed)'"""
+    hashes = {}
+    plan = []
+    for stage in self.stages.values():
+      if any(hashes[upstream] is None for upstream in stage.inputs.values()):
+        hashes[stage.name] = None
+        plan.append((stage.name, "run (upstream changed)"))
+        continue
+
+      manifest = self.store.load(stage.name, self.stage_key(stage, hashes))
+      hashes[stage.name] = manifest["hash"] if manifest else None
+      plan.append((stage.name, "reuse" if manifest else "run"))
+    return plan
+
+  def report(self):
+    print("Pipeline plan:")
+    for name, status in self.plan():
+      print(f"  {name:<24} {status}")
+
+  async def run_stage(self, stage, results, hashes):
+    key = self.stage_key(stage, hashes)
+    manifest = self.store.load(stage.name, key)
+
+    if manifest:
+      print(f"[{stage.name}] reusing cached artifact")
+    else:
+      print(f"[{stage.name}] running")
+      out_dir = self.store.stage_dir(stage.name, key)
+      os.makedirs(out_dir, exist_ok=True)
+
+      kwargs = {arg: results[upstream] for arg, upstream in stage.inputs.items()}
+      kwargs.update(stage.sources)
+      outputs = stage.fn(out_dir, **kwargs)
+      if inspect.isawaitable(outputs):
+        outputs = await outputs
+      manifest = self.store.save(stage.name, key, outputs)
+
+    results[stage.name] = manifest["outputs"]
+    hashes[stage.name] = manifest["hash"]
+
+  async def run(self, dry_run=False):
+    """Run every stage (or only report what would run); returns {stage name: outputs}"""
+    if dry_run:
+      self.report()
+      return None
+
+    results = {}
+    hashes = {}
+    pending = list(self.stages.values())
+    while pending:
+      ready = [stage for stage in pending if all(upstream in hashes for upstream in stage.inputs.values())]
+      await asyncio.gather(*(self.run_stage(stage, results, hashes) for stage in ready))
+      pending = [stage for stage in pending if stage.name not in hashes]
+    return results
@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import soundfile as sf
+
+# Length of the voice prompt given to the TTS model
+REFERENCE_SECONDS = float(os.getenv("TTS_REFERENCE_SECONDS") or 10)
+
+def frame_levels_db(samples, sample_rate, frame_seconds=0.03):
+  """RMS level in dBFS of consecutive short frames"""
+  frame = max(1, int(frame_seconds * sample_rate))
+  n_frames = len(samples) // frame
+  if n_frames == 0:
+    return np.array([-120.0])
+  frames = samples[:n_frames * frame].reshape(n_frames, frame)
+  return 10 * np.log10(np.mean(np.square(frames), axis=1) + 1e-12)
+
+def read_mono(f, start, end):
+  f.seek(int(start * f.samplerate))
+  samples = f.read(int((end - start) * f.samplerate), dtype='float32', always_2d=True)
+  return samples.mean(axis=1)
+
+def score_segment(vocals, sample_rate, background=None, no_speech_prob=0.0):
+  """
+  Higher is cleaner speech. Within-segment SNR is the spread between loud
+  (speech) and quiet (floor) frames; when the background stem is available, the
+  vocals-to-background ratio counts too. Clipped, very quiet and likely
+  non-speech segments are penalized.
+  """
+  levels = frame_levels_db(vocals, sample_rate)
+  speech_db = np.percentile(levels, 90)
+  floor_db = np.percentile(levels, 10)
+  score = speech_db - floor_db
+
+  if background is not None and len(background):
+    background_db = 10 * np.log10(np.mean(np.square(background)) + 1e-12)
+    vocals_db = 10 * np.log10(np.mean(np.square(vocals)) + 1e-12)
+    score += min(vocals_db - background_db, 30)
+
+  if np.max(np.abs(vocals), initial=0) >= 0.99:
+    score -= 20
+  if speech_db < -45:
+    score -= 20
+  return score - 20 * no_speech_prob
+
+def select_reference_clip(vocals_path, segments, output_path, target_seconds=None, background_path=None,
+                          min_segment_seconds=1.5, max_segment_seconds=8):
+  """
+  Write a short TTS reference clip built from the cleanest transcript segments.
+
+  Each segment of the (preferably separated) vocals is scored with score_segment;
+  the best ones are taken until target_seconds is reached and joined in
+  chronological order with short gaps. Only the segments themselves are read, so
+  the cost doesn't depend on the length of the video. Falls back to the start of
+  the file when no segment qualifies. Returns output_path.
+  """
+  target_seconds = target_seconds or REFERENCE_SECONDS
+
+  with sf.SoundFile(vocals_path) as vocals_file:
+    sample_rate = vocals_file.samplerate
+    duration = vocals_file.frames / sample_rate
+    background_file = sf.SoundFile(background_path) if background_path else None
+
+    candidates = []
+    try:
+      for segment in segments:
+        start = max(0.0, segment['start'])
+        end = min(segment['end'], duration, start + max_segment_seconds)
+        if end - start < min_segment_seconds:
+          continue
+        vocals = read_mono(vocals_file, start, end)
+        background = read_mono(background_file, start, end) if background_file else None
+        score = score_segment(vocals, sample_rate, background, segment.get('no_speech_prob') or 0.0)
+        candidates.append((score, start, end))
+    finally:
+      if background_file:
+        background_file.close()
+
+    chosen = []
+    total = 0.0
+    for score, start, end in sorted(candidates, reverse=True):
+      if total >= target_seconds:
+        break
+      end = min(end, start + target_seconds - total)
+      if end - start < 0.5:
+        break
+      chosen.append((start, end))
+      total += end - start
+
+    if not chosen:
+      print("No clean speech segment found, using the start of the audio as TTS reference")
+      chosen = [(0.0, min(duration, target_seconds))]
+
+    gap = np.zeros(int(0.15 * sample_rate), dtype=np.float32)
+    pieces = []
+    for start, end in sorted(chosen):
+      pieces.extend([read_mono(vocals_file, start, end), gap])
+
+  sf.write(output_path, np.concatenate(pieces[:-1]), sample_rate, subtype='FLOAT')
+  print(f"TTS reference: {len(chosen)} segments, {sum(end - start for start, end in chosen):.1f}s")
+  return output_path
@@ -0,0 +1,89 @@
+import os
+import re
+
+MAX_UNIT_SECONDS = float(os.getenv("SEGMENT_MAX_SECONDS") or 12)
+MAX_UNIT_CHARS = int(os.getenv("SEGMENT_MAX_CHARS") or 200)
+MAX_GAP_SECONDS = float(os.getenv("SEGMENT_MAX_GAP_SECONDS") or 1.0)
+
+# Sentence-final punctuation, optionally followed by closing quotes or brackets
+SENTENCE_END = re.compile(r'[.!?…。！？؟۔]["\'”’»)\]]*$')
+# Scripts written without spaces between words
+UNSPACED_SCRIPT = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\u0e00-\u0e7f\uac00-\ud7af]')
+
+def resegment(segments, max_seconds=None, max_chars=None, max_gap=None):
+  """
+  Merge Whisper segments into sentence-sized units.
+
+  Consecutive segments are joined while the unit doesn't end a sentence, the
+  pause between them is at most max_gap, and the unit stays within max_seconds
+  and max_chars. Each unit keeps its source segments under "sources" so text can
+  be mapped back to the original granularity with split_back.
+  """
+  max_seconds = max_seconds or MAX_UNIT_SECONDS
+  max_chars = max_chars or MAX_UNIT_CHARS
+  max_gap = MAX_GAP_SECONDS if max_gap is None else max_gap
+
+  units = []
+  for segment in segments:
+    text = segment['text'].strip()
+    if not text:
+      continue
+    source = {'id': segment.get('id'), 'start': segment['start'], 'end': segment['end'], 'text': text}
+
+    unit = units[-1] if units else None
+    if (unit
+        and not SENTENCE_END.search(unit['text'])
+        and segment['start'] - unit['end'] <= max_gap
+        and segment['end'] - unit['start'] <= max_seconds
+        and len(unit['text']) + 1 + len(text) <= max_chars):
+      unit['text'] = f"{unit['text']} {text}"
+      unit['end'] = segment['end']
+      unit['sources'].append(source)
+    else:
+      units.append({'id': len(units), 'start': segment['start'], 'end': segment['end'], 'text': text, 'sources': [source]})
+  return units
+
+def split_text(text, weights):
+  """Split text into len(weights) consecutive parts sized by weight, on word boundaries where there are any"""
+  tokens, separator = text.split(), " "
+  if len(tokens) < len(weights) and UNSPACED_SCRIPT.search(text):
+    # Chinese, Japanese, Thai... split between characters
+    tokens, separator = list("".join(tokens)), ""
+
+  total = sum(weights) or 1
+  parts = []
+  start = cumulative = 0
+  for i, weight in enumerate(weights):
+    cumulative += weight
+    end = len(tokens) if i == len(weights) - 1 else round(len(tokens) * cumulative / total)
+    parts.append(separator.join(tokens[start:end]))
+    start = end
+  return parts
+
+def split_back(units, texts):
+  """
+  Map one text per unit (e.g. its translation) back onto the unit's source
+  segments, proportionally to the source text lengths. Returns segments with
+  the original timings; a source that gets no words is absorbed by its neighbour.
+  """
+  segments = []
+  for unit, text in zip(units, texts):
+    sources = unit['sources']
+    parts = split_text(text, [len(source['text']) for source in sources])
+
+    unit_segments = []
+    pending_start = None
+    for source, part in zip(sources, parts):
+      if part:
+        start = source['start'] if pending_start is None else pending_start
+        unit_segments.append({'start': start, 'end': source['end'], 'text': part})
+        pending_start = None
+      elif unit_segments:
+        unit_segments[-1]['end'] = source['end']
+      elif pending_start is None:
+        pending_start = source['start']
+    segments.extend(unit_segments)
+
+  for i, segment in enumerate(segments):
+    segment['id'] = i
+  return segments
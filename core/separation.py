@@ -0,0 +1,413 @@
+import os
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import soundfile as sf
+from .models import model_registry
+
+DEMUCS_MODEL = os.getenv("DEMUCS_MODEL", "htdemucs")
+# Inner segment length in seconds, None for the model default
+DEMUCS_SEGMENT = float(os.getenv("DEMUCS_SEGMENT")) if os.getenv("DEMUCS_SEGMENT") else None
+STEM_CACHE_DIR = os.getenv("STEM_CACHE_DIR", "temp/stems")
+
+def samples_sha256(samples, block_frames=1024 * 1024):
+  """sha256 of a (possibly memory-mapped) sample buffer, read block by block"""
+  digest = hashlib.sha256()
+  for start in range(0, len(samples), block_frames):
+    digest.update(np.ascontiguousarray(samples[start:start + block_frames]).tobytes())
+  return digest.hexdigest()
+
+def block_ranges(start, end, block_frames, overlap_frames):
+  """(start, end) frame ranges of block_frames covering [start, end), consecutive ranges sharing overlap_frames"""
+  while True:
+    block_end = min(start + block_frames, end)
+    yield start, block_end
+    if block_end >= end:
+      return
+    start = block_end - overlap_frames
+
+def crossfade_blocks(blocks, overlap, margin=0):
+  """
+  Turn a stream of output blocks that overlap by `overlap` frames into
+  contiguous chunks, crossfading the shared frames. Every item of `blocks` is a
+  list of stems; the tail of each block is held back until the next arrives.
+  The first and last `margin` shared frames are taken from one side only, which
+  keeps edge effects (e.g. STFT padding) out of the output.
+  """
+  fade_in = np.clip((np.arange(overlap, dtype=np.float32) - margin) / max(overlap - 2 * margin, 1), 0, 1)
+  tails = None
+  for stems in blocks:
+    if tails is not None:
+      for stem, tail in zip(stems, tails):
+        fade = fade_in.reshape((-1,) + (1,) * (stem.ndim - 1))
+        stem[:overlap] = tail * (1 - fade) + stem[:overlap] * fade
+    yield [stem[:len(stem) - overlap] for stem in stems]
+    # Copied, since blocks may live in buffers that are reused for the next block
+    tails = [stem[len(stem) - overlap:].copy() for stem in stems]
+  if tails is not None:
+    yield tails
+
+def read_blocks(audio_path, sample_rate, block_frames, overlap_frames, mono=False, start=0, end=None):
+  """
+  Yield float32 blocks of block_frames that overlap by overlap_frames, read from
+  disk with soundfile (optionally only frames [start, end)). Files soundfile
+  can't read, or that need resampling, are decoded whole with librosa instead.
+  """
+  try:
+    f = sf.SoundFile(audio_path)
+  except RuntimeError:
+    f = None
+
+  if f is not None and f.samplerate == sample_rate:
+    with f:
+      end = f.frames if end is None else min(end, f.frames)
+      for block_start, block_end in block_ranges(start, end, block_frames, overlap_frames):
+        f.seek(block_start)
+        block = f.read(block_end - block_start, dtype='float32', always_2d=True)
+        yield block.mean(axis=1) if mono else block
+    return
+  if f is not None:
+    f.close()
+
+  import librosa
+  y, _ = librosa.load(audio_path, sr=sample_rate, mono=mono)
+  y = (y if mono else np.atleast_2d(y).T)[start:end]
+  for block_start, block_end in block_ranges(0, len(y), block_frames, overlap_frames):
+    yield y[block_start:block_end]
+
+def normalize_to_file(raw_path, output_path, peak, subtype='PCM_24', block_frames=1024 * 1024):
+  """Second normalization pass: rescale a float WAV by its peak into output_path"""
+  with sf.SoundFile(raw_path) as raw, \
+       sf.SoundFile(output_path, 'w', raw.samplerate, raw.channels, subtype=subtype, format='WAV') as output:
+    for block in raw.blocks(blocksize=block_frames, dtype='float32'):
+      output.write(block / (peak + 1e-8))
+  os.remove(raw_path)
+
+def spectral_separate_block(y, sr, hop_length=512):
+  """
+  Repetition-based vocal/background masks for one mono block. The nearest
+  neighbour search of nn_filter only spans this block.
+  """
+  import librosa
+  from scipy.ndimage import median_filter
+
+  S_full = librosa.stft(y, hop_length=hop_length)
+
+  # 1. Median filtering for repetitive background removal
+  S_abs = np.abs(S_full)
+  S_filter = librosa.decompose.nn_filter(S_abs,
+                                         aggregate=np.median,
+                                         metric='cosine',
+                                         width=max(1, min(int(sr/hop_length), (S_abs.shape[1] - 1) // 2 - 1)))
+
+  # 2. Conservative margins - preserve more music
+  freq_bins = librosa.fft_frequencies(sr=sr, n_fft=2048)
+  vocal_range = (freq_bins >= 200) & (freq_bins <= 800)  # narrower vocal range
+  margin_v = np.full(freq_bins.shape, 1.5, dtype=np.float32)
+  margin_i = np.full(freq_bins.shape, 0.3, dtype=np.float32)
+  margin_v[vocal_range] = 2.5
+  margin_i[vocal_range] = 0.5
+
+  # 3. Gentler masking, S_abs becomes S_diff in place
+  S_abs -= S_filter * 0.5
+  np.maximum(S_abs, 0, out=S_abs)
+  mask_v = librosa.util.softmask(S_abs, margin_i[:, np.newaxis] * S_filter, power=1.5)
+  mask_i = librosa.util.softmask(S_filter, margin_v[:, np.newaxis] * S_abs, power=1.5)
+  del S_abs, S_filter
+  np.maximum(mask_i, 0.2, out=mask_i)  # always keep at least 20% of original
+
+  # 4. Temporal smoothing to reduce artifacts
+  mask_v = median_filter(mask_v, size=(1, 3))
+  mask_i = median_filter(mask_i, size=(1, 3))
+
+  S_background = S_full * mask_i
+  S_full *= mask_v  # S_full is the foreground from here on
+  del mask_v, mask_i
+
+  y_foreground = librosa.istft(S_full, hop_length=hop_length, length=len(y))
+  y_background = librosa.istft(S_background, hop_length=hop_length, length=len(y))
+  return y_foreground, y_background
+
+def separate_spectral(audio_path, vocals_path, instrumental_path, sample_rate=44100, block_seconds=30, overlap_seconds=2):
+  """
+  Block-wise spectral separation with peak memory independent of file length:
+  overlapping blocks are separated, crossfaded and written incrementally, the
+  preemphasis filters carry their state across blocks and peak normalization is
+  a second pass over the written files.
+  """
+  import librosa
+
+  # Whole hops, so every block shares the STFT frame grid of the full signal
+  hop_length = 512
+  block = int(block_seconds * sample_rate) // hop_length * hop_length
+  overlap = int(overlap_seconds * sample_rate) // hop_length * hop_length
+  blocks = (list(spectral_separate_block(y, sample_rate)) for y in read_blocks(audio_path, sample_rate, block, overlap, mono=True))
+  # nn_filter and the median filter see less context at block edges, so the crossfade avoids them
+
+  peaks = [0.0, 0.0]
+  states = [None, None]
+  coefs = [0.97, -0.97]  # emphasize highs for vocals, boost lows for the instrumental
+  raw_paths = [vocals_path + ".raw.wav", instrumental_path + ".raw.wav"]
+  with sf.SoundFile(raw_paths[0], 'w', sample_rate, 1, subtype='FLOAT', format='WAV') as vocals_file, \
+       sf.SoundFile(raw_paths[1], 'w', sample_rate, 1, subtype='FLOAT', format='WAV') as instrumental_file:
+    for chunks in crossfade_blocks(blocks, overlap, margin=overlap // 4):
+      for i, (chunk, output) in enumerate(zip(chunks, (vocals_file, instrumental_file))):
+        if not len(chunk):
+          continue
+        chunk, states[i] = librosa.effects.preemphasis(chunk, coef=coefs[i], zi=states[i], return_zf=True)
+        peaks[i] = max(peaks[i], float(np.max(np.abs(chunk), initial=0)))
+        output.write(chunk)
+
+  normalize_to_file(raw_paths[0], vocals_path, peaks[0])
+  normalize_to_file(raw_paths[1], instrumental_path, peaks[1])
+  return vocals_path, instrumental_path
+
+class CenterExtractor:
+  """
+  Mid/side spectral gating for stereo blocks of up to block_frames, in float32.
+  STFT, magnitude, mask and output buffers are allocated once and reused for
+  every block; the returned stems are views into them.
+  """
+  def __init__(self, block_frames, n_fft=2048, hop_length=512):
+    self.n_fft = n_fft
+    self.hop_length = hop_length
+    bins, frames = 1 + n_fft // 2, 1 + block_frames // hop_length
+    self.center = np.empty(block_frames, dtype=np.float32)
+    self.sides = np.empty(block_frames, dtype=np.float32)
+    self.S_center = np.empty((bins, frames), dtype=np.complex64)
+    self.S_sides = np.empty((bins, frames), dtype=np.complex64)
+    self.magnitude_center = np.empty((bins, frames), dtype=np.float32)
+    self.magnitude_sides = np.empty((bins, frames), dtype=np.float32)
+    self.threshold = np.empty((bins, frames), dtype=np.float32)
+    self.mask_vocals = np.empty((bins, frames), dtype=bool)
+    self.mask_instruments = np.empty((bins, frames), dtype=bool)
+    self.not_vocals = np.empty((bins, frames), dtype=bool)
+    self.vocals = np.empty(block_frames, dtype=np.float32)
+    self.instruments = np.empty(block_frames, dtype=np.float32)
+
+  def process(self, block):
+    """(frames, 2) float32 block -> (vocals, instruments) mono float32 views"""
+    import librosa
+
+    n = len(block)
+    frames = 1 + n // self.hop_length
+    center, sides = self.center[:n], self.sides[:n]
+
+    # Center extraction (vocals) and sides (instruments)
+    np.add(block[:, 0], block[:, 1], out=center)
+    center *= 0.5
+    np.subtract(block[:, 0], block[:, 1], out=sides)
+    sides *= 0.5
+
+    S_center = librosa.stft(center, n_fft=self.n_fft, hop_length=self.hop_length, out=self.S_center)
+    S_sides = librosa.stft(sides, n_fft=self.n_fft, hop_length=self.hop_length, out=self.S_sides)
+
+    magnitude_center = np.abs(S_center, out=self.magnitude_center[:, :frames])
+    magnitude_sides = np.abs(S_sides, out=self.magnitude_sides[:, :frames])
+    threshold = self.threshold[:, :frames]
+    mask_vocals = self.mask_vocals[:, :frames]
+    mask_instruments = self.mask_instruments[:, :frames]
+
+    # Masks based on which channel is dominant
+    np.greater(magnitude_center, np.multiply(magnitude_sides, 1.5, out=threshold), out=mask_vocals)
+    np.greater(magnitude_sides, np.multiply(magnitude_center, 0.8, out=threshold), out=mask_instruments)
+
+    # instruments = S_sides * mask_instruments + S_center * ~mask_vocals, built in S_sides
+    S_sides *= mask_instruments
+    np.add(S_sides, S_center, out=S_sides, where=np.logical_not(mask_vocals, out=self.not_vocals[:, :frames]))
+    S_center *= mask_vocals
+
+    vocals = librosa.istft(S_center, hop_length=self.hop_length, length=n, out=self.vocals[:n])
+    instruments = librosa.istft(S_sides, hop_length=self.hop_length, length=n, out=self.instruments[:n])
+    return vocals, instruments
+
+def _center_extract_chunks(audio_path, sample_rate, block, overlap, start=0, end=None):
+  extractor = CenterExtractor(block)
+  blocks = (list(extractor.process(y)) for y in read_blocks(audio_path, sample_rate, block, overlap, start=start, end=end))
+  return crossfade_blocks(blocks, overlap, margin=extractor.n_fft)
+
+def _center_extract_region(audio_path, sample_rate, start, end, block, overlap, output_paths):
+  with sf.SoundFile(output_paths[0], 'w', sample_rate, 1, subtype='FLOAT', format='WAV') as vocals_file, \
+       sf.SoundFile(output_paths[1], 'w', sample_rate, 1, subtype='FLOAT', format='WAV') as instruments_file:
+    for vocals, instruments in _center_extract_chunks(audio_path, sample_rate, block, overlap, start, end):
+      vocals_file.write(vocals)
+      instruments_file.write(instruments)
+  return output_paths
+
+def separate_center(audio_path, vocals_path, instrumental_path, block_seconds=30, overlap_seconds=0.5,
+                    workers=1, region_seconds=600):
+  """
+  Streaming center-channel extraction of a stereo file at its native sample rate.
+
+  Blocks are read from disk, gated and written incrementally, then peak
+  normalized in a second pass. With workers > 1, files longer than one region
+  are split into overlapping regions processed in a process pool and crossfaded
+  back together.
+  """
+  info = sf.info(audio_path)
+  sample_rate = info.samplerate
+  # Whole hops, so every block shares the STFT frame grid of the full signal
+  hop_length = 512
+  block = int(block_seconds * sample_rate) // hop_length * hop_length
+  overlap = int(overlap_seconds * sample_rate) // hop_length * hop_length
+  region = max(int(region_seconds * sample_rate) // hop_length * hop_length, block)
+
+  if workers > 1 and info.frames > region:
+    regions = list(block_ranges(0, info.frames, region, overlap))
+    region_paths = [(f"{vocals_path}.{i}.raw.wav", f"{instrumental_path}.{i}.raw.wav") for i in range(len(regions))]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+      futures = [
+        executor.submit(_center_extract_region, audio_path, sample_rate, start, end, block, overlap, paths)
+        for (start, end), paths in zip(regions, region_paths)
+      ]
+      # Region outputs overlap like blocks do, so they are crossfaded the same way
+      chunks = crossfade_blocks((
+        [sf.read(path, dtype='float32')[0] for path in future.result()] for future in futures
+      ), overlap, margin=2048)
+      peaks = _write_raw_stems(chunks, sample_rate, vocals_path, instrumental_path)
+    for paths in region_paths:
+      for path in paths:
+        os.remove(path)
+  else:
+    chunks = _center_extract_chunks(audio_path, sample_rate, block, overlap)
+    peaks = _write_raw_stems(chunks, sample_rate, vocals_path, instrumental_path)
+
+  normalize_to_file(vocals_path + ".raw.wav", vocals_path, peaks[0], subtype='PCM_16')
+  normalize_to_file(instrumental_path + ".raw.wav", instrumental_path, peaks[1], subtype='PCM_16')
+  return vocals_path, instrumental_path
+
+def _write_raw_stems(chunks, sample_rate, vocals_path, instrumental_path):
+  """Write (vocals, instruments) chunks to float WAVs next to the final paths; returns their peaks"""
+  peaks = [0.0, 0.0]
+  with sf.SoundFile(vocals_path + ".raw.wav", 'w', sample_rate, 1, subtype='FLOAT', format='WAV') as vocals_file, \
+       sf.SoundFile(instrumental_path + ".raw.wav", 'w', sample_rate, 1, subtype='FLOAT', format='WAV') as instruments_file:
+    for vocals, instruments in chunks:
+      vocals_file.write(vocals)
+      instruments_file.write(instruments)
+      peaks[0] = max(peaks[0], float(np.max(np.abs(vocals), initial=0)))
+      peaks[1] = max(peaks[1], float(np.max(np.abs(instruments), initial=0)))
+  return peaks
+
+class DemucsSeparator:
+  """
+  In-process Demucs vocals/accompaniment separation.
+
+  The model is loaded once through the model registry. Long inputs are fed to
+  apply_model in outer blocks of block_seconds that overlap by overlap_seconds
+  and are crossfaded, and both stems are written to disk block by block, so
+  memory stays bounded on long files. segment is Demucs' own inner segment
+  length in seconds (None for the model default).
+
+  Stems are cached in {cache_dir}/{model}[-segment{n}]/{source hash}/ so separating the same
+  audio again is free.
+  """
+  def __init__(self, model_name=None, device="cpu", segment=None, threads=None, block_seconds=None,
+               overlap_seconds=1.0, cache_dir=None):
+    self.model_name = model_name or DEMUCS_MODEL
+    self.device = device
+    self.segment = segment or DEMUCS_SEGMENT
+    self.threads = threads or int(os.getenv("DEMUCS_THREADS") or 0)
+    self.block_seconds = block_seconds or float(os.getenv("DEMUCS_BLOCK_SECONDS") or 60)
+    self.overlap_seconds = overlap_seconds
+    self.cache_dir = cache_dir or STEM_CACHE_DIR
+
+  def load_model(self):
+    def load():
+      from demucs.pretrained import get_model
+
+      model = get_model(self.model_name)
+      model.to(self.device)
+      return model.eval()
+
+    return model_registry.get(("demucs", self.model_name, self.device), load)
+
+  def warm_up(self):
+    self.load_model()
+    return self
+
+  def stem_paths(self, source_hash):
+    model_dir = self.model_name if self.segment is None else f"{self.model_name}-segment{self.segment:g}"
+    stem_dir = os.path.join(self.cache_dir, model_dir, source_hash)
+    return os.path.join(stem_dir, "vocals.wav"), os.path.join(stem_dir, "no_vocals.wav")
+
+  def separate_file(self, audio_path):
+    """Separate an audio file; returns (vocals path, instrumental path)"""
+    from .dubbed_video_generation import decode_audio
+
+    model = self.load_model()
+    samples = decode_audio(audio_path, model.samplerate, model.audio_channels)
+    return self.separate(samples, model.samplerate)
+
+  def separate(self, samples, sample_rate, source_hash=None):
+    """
+    Separate a float32 (frames, channels) buffer at the model's sample rate;
+    returns (vocals path, instrumental path)
+    """
+    model = self.load_model()
+    if sample_rate != model.samplerate:
+      raise ValueError(f"{self.model_name} expects {model.samplerate} Hz audio, got {sample_rate} Hz")
+
+    source_hash = source_hash or samples_sha256(samples)
+    vocals_path, instrumental_path = self.stem_paths(source_hash)
+    if os.path.exists(vocals_path) and os.path.exists(instrumental_path):
+      print(f"Reusing cached stems for {source_hash[:12]}")
+      return vocals_path, instrumental_path
+
+    os.makedirs(os.path.dirname(vocals_path), exist_ok=True)
+    self.write_stems(model, samples, vocals_path + ".tmp", instrumental_path + ".tmp")
+    os.replace(vocals_path + ".tmp", vocals_path)
+    os.replace(instrumental_path + ".tmp", instrumental_path)
+    return vocals_path, instrumental_path
+
+  def normalization(self, samples, block_frames=1024 * 1024):
+    # Demucs normalizes by the mono mix's global statistics; accumulate them block by block
+    total = total_squares = 0.0
+    for start in range(0, len(samples), block_frames):
+      mono = np.asarray(samples[start:start + block_frames], dtype=np.float64).mean(axis=1)
+      total += mono.sum()
+      total_squares += np.square(mono).sum()
+    mean = total / len(samples)
+    std = np.sqrt(max(total_squares / len(samples) - mean ** 2, 0.0))
+    return mean, std + 1e-8
+
+  def separate_block(self, model, block, mean, std):
+    import torch
+    from demucs.apply import apply_model
+
+    mix = torch.from_numpy(((block - mean) / std).T.astype(np.float32))
+    with torch.no_grad():
+      sources = apply_model(model, mix[None], shifts=0, split=True, overlap=0.25,
+                            segment=self.segment, progress=False, device=self.device)[0]
+    sources = (sources * std + mean).cpu().numpy()
+
+    vocals_index = model.sources.index("vocals")
+    vocals = sources[vocals_index]
+    instrumental = sources.sum(axis=0) - vocals
+    return vocals.T, instrumental.T
+
+  def write_stems(self, model, samples, vocals_path, instrumental_path):
+    import torch
+
+    if self.threads:
+      torch.set_num_threads(self.threads)
+
+    samples = samples if samples.ndim == 2 else samples[:, None]
+    if samples.shape[1] != model.audio_channels:
+      samples = np.repeat(samples[:, :1], model.audio_channels, axis=1)
+
+    sample_rate = model.samplerate
+    block = int(self.block_seconds * sample_rate)
+    overlap = int(self.overlap_seconds * sample_rate)
+    mean, std = self.normalization(samples)
+
+    def blocks():
+      for start, end in block_ranges(0, len(samples), block, overlap):
+        yield list(self.separate_block(model, np.asarray(samples[start:end]), mean, std))
+        print(f"Separated {end / sample_rate:.0f}s / {len(samples) / sample_rate:.0f}s")
+
+    with sf.SoundFile(vocals_path, 'w', sample_rate, model.audio_channels, subtype='FLOAT', format='WAV') as vocals_file, \
+         sf.SoundFile(instrumental_path, 'w', sample_rate, model.audio_channels, subtype='FLOAT', format='WAV') as instrumental_file:
+      for vocals, instrumental in crossfade_blocks(blocks(), overlap):
+        vocals_file.write(vocals)
+        instrumental_file.write(instrumental)
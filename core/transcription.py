@@ -0,0 +1,273 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Whisper works on 16 kHz mono audio
+SAMPLE_RATE = 16000
+
+# "whisper_timestamped" (PyTorch) or "ctranslate2"
+TRANSCRIPTION_BACKEND = os.getenv("TRANSCRIPTION_BACKEND", "whisper_timestamped")
+CT2_MODEL_DIR = os.getenv("CT2_MODEL_DIR", "models/ctranslate2")
+
+class TranscriptionBackend:
+  """
+  Turns a 16 kHz mono float32 array into a Whisper-style result dict:
+  {"text", "segments": [{"id", "seek", "start", "end", "text", ...}], "language"}
+
+  Segments only carry "words" when word_timestamps is requested and the backend
+  supports it.
+  """
+  name = None
+
+  def __init__(self, model_size=None, device="cpu", compute_type=None):
+    from .audio import WHISPER_MODEL
+
+    self.model_size = model_size or WHISPER_MODEL
+    self.device = device
+    self.compute_type = compute_type
+
+  def warm_up(self):
+    pass
+
+  def transcribe(self, audio, language="en", word_timestamps=False):
+    raise NotImplementedError
+
+class WhisperTimestampedBackend(TranscriptionBackend):
+  """
+  PyTorch Whisper. Word timestamps come from whisper_timestamped's cross-attention
+  DTW; without them the same model runs plain Whisper decoding, which skips the
+  alignment and the attention tensors it keeps around.
+  """
+  name = "whisper_timestamped"
+
+  def load_model(self):
+    from .audio import Audio
+    return Audio().load_whisper_model(self.model_size, self.device, self.compute_type or "float32")
+
+  def warm_up(self):
+    self.load_model()
+
+  def transcribe(self, audio, language="en", word_timestamps=False):
+    import whisper_timestamped as whisper
+
+    model = self.load_model()
+    fp16 = self.compute_type == "float16"
+    if not word_timestamps:
+      return model.transcribe(audio, language=language, word_timestamps=False, fp16=fp16)
+    return whisper.transcribe(model, audio, language=language, fp16=fp16)
+
+class CTranslate2Backend(TranscriptionBackend):
+  """
+  Whisper on CTranslate2, int8 by default for CPU-only nodes.
+
+  The converted model lives in {CT2_MODEL_DIR}/whisper-{size}-{compute_type} and is
+  converted from the Hugging Face checkpoint on first use. Audio is decoded in
+  30 s windows; segments come from Whisper's timestamp tokens.
+  """
+  name = "ctranslate2"
+
+  def __init__(self, model_size=None, device="cpu", compute_type=None, inter_threads=None, intra_threads=None):
+    super().__init__(model_size, device, compute_type or "int8")
+    self.inter_threads = inter_threads or int(os.getenv("CT2_INTER_THREADS") or 1)
+    self.intra_threads = intra_threads or int(os.getenv("CT2_INTRA_THREADS") or 0)  # 0 = CTranslate2 default
+    self.model_dir = os.path.join(CT2_MODEL_DIR, f"whisper-{self.model_size}-{self.compute_type}")
+
+  def convert(self):
+    from ctranslate2.converters import TransformersConverter
+
+    print(f"Converting openai/whisper-{self.model_size} to CTranslate2 ({self.compute_type})")
+    TransformersConverter(f"openai/whisper-{self.model_size}", copy_files=["tokenizer.json"]).convert(
+      self.model_dir, quantization=self.compute_type
+    )
+
+  def load_model(self):
+    import ctranslate2
+    from .models import model_registry
+
+    def load():
+      if not os.path.exists(os.path.join(self.model_dir, "model.bin")):
+        self.convert()
+      return ctranslate2.models.Whisper(
+        self.model_dir,
+        device=self.device,
+        compute_type=self.compute_type,
+        inter_threads=self.inter_threads,
+        intra_threads=self.intra_threads
+      )
+
+    key = ("ctranslate2-whisper", self.model_size, self.device, self.compute_type, self.inter_threads, self.intra_threads)
+    return model_registry.get(key, load, lambda model: os.path.getsize(os.path.join(self.model_dir, "model.bin")))
+
+  def warm_up(self):
+    self.load_model()
+
+  def detect_language(self, model, features):
+    language_token, _ = model.detect_language(features)[0][0]
+    return language_token[2:-2]
+
+  def transcribe(self, audio, language="en", word_timestamps=False):
+    # Segment timestamps only; word_timestamps is not supported by this backend
+    import ctranslate2
+    import whisper as openai_whisper
+
+    model = self.load_model()
+    n_mels = getattr(model, "n_mels", 80)
+    window = openai_whisper.audio.N_SAMPLES
+    seconds_per_timestamp = 0.02
+
+    tokenizer = None
+    segments = []
+    seek = 0
+    while seek < len(audio):
+      chunk = audio[seek:seek + window]
+      mel = openai_whisper.log_mel_spectrogram(openai_whisper.pad_or_trim(chunk), n_mels)
+      features = ctranslate2.StorageView.from_array(mel.numpy()[None])
+
+      if tokenizer is None:
+        language = language or self.detect_language(model, features)
+        tokenizer = openai_whisper.tokenizer.get_tokenizer(
+          model.is_multilingual, num_languages=getattr(model, "num_languages", 99), language=language, task="transcribe"
+        )
+
+      result = model.generate(features, [list(tokenizer.sot_sequence)], beam_size=5, max_length=448)
+      tokens = result[0].sequences_ids[0]
+
+      # <|t0|> text <|t1|><|t1|> text <|t2|> ... ; an unclosed trailing segment is decoded again
+      # from its start in the next window
+      offset = seek / SAMPLE_RATE
+      start = 0.0
+      text_tokens = []
+      for token in tokens:
+        if token >= tokenizer.timestamp_begin:
+          timestamp = (token - tokenizer.timestamp_begin) * seconds_per_timestamp
+          if text_tokens:
+            segments.append(self.make_segment(tokenizer, seek, offset + start, offset + timestamp, text_tokens))
+            text_tokens = []
+          start = timestamp
+        elif token < tokenizer.eot:
+          text_tokens.append(token)
+
+      chunk_seconds = len(chunk) / SAMPLE_RATE
+      if text_tokens and start > 0 and len(chunk) == window:
+        seek += int(start * SAMPLE_RATE)
+        continue
+      if text_tokens:
+        segments.append(self.make_segment(tokenizer, seek, offset + start, offset + chunk_seconds, text_tokens))
+      seek += len(chunk)
+
+    for i, segment in enumerate(segments):
+      segment["id"] = i
+
+    return {
+      "text": "".join(segment["text"] for segment in segments),
+      "segments": segments,
+      "language": language
+    }
+
+  def make_segment(self, tokenizer, seek, start, end, tokens):
+    return {
+      "id": None,
+      "seek": seek,
+      "start": round(start, 2),
+      "end": round(end, 2),
+      "text": tokenizer.decode(tokens),
+      "tokens": tokens
+    }
+
+BACKENDS = {
+  WhisperTimestampedBackend.name: WhisperTimestampedBackend,
+  CTranslate2Backend.name: CTranslate2Backend
+}
+
+def get_backend(name=None, model_size=None, device="cpu", compute_type=None):
+  name = name or TRANSCRIPTION_BACKEND
+  if name not in BACKENDS:
+    raise ValueError(f"Unknown transcription backend '{name}', expected one of {', '.join(BACKENDS)}")
+  return BACKENDS[name](model_size, device, compute_type)
+
+def find_split_points(audio, target_chunk_seconds=300, search_seconds=30, sample_rate=SAMPLE_RATE):
+  """
+  Energy-based VAD splitting: near every target_chunk_seconds, cut at the quietest
+  point within +/- search_seconds so chunk boundaries land in pauses, not words.
+  Returns sample offsets of the cuts.
+  """
+  frame = int(0.03 * sample_rate)
+  n_frames = len(audio) // frame
+  if n_frames == 0:
+    return []
+
+  energy = np.mean(np.square(audio[:n_frames * frame].reshape(n_frames, frame)), axis=1)
+  # Smooth over ~0.3 s so a cut needs a real pause, not a gap between syllables
+  energy = np.convolve(energy, np.ones(10) / 10, mode='same')
+
+  frames_per_second = sample_rate / frame
+  target = int(target_chunk_seconds * frames_per_second)
+  search = int(search_seconds * frames_per_second)
+
+  splits = []
+  position = target
+  # Don't leave a tail chunk shorter than the search window
+  while position < n_frames - search:
+    start, end = max(0, position - search), min(n_frames, position + search)
+    cut = start + int(np.argmin(energy[start:end]))
+    splits.append(cut * frame)
+    position = cut + target
+  return splits
+
+def _init_worker(model_size, backend, threads_per_worker):
+  import torch
+
+  torch.set_num_threads(threads_per_worker)
+  os.environ["CT2_INTRA_THREADS"] = str(threads_per_worker)
+  get_backend(backend, model_size).warm_up()
+
+def _transcribe_chunk(audio_chunk, offset_seconds, language, model_size, backend, word_timestamps):
+  result = get_backend(backend, model_size).transcribe(audio_chunk, language, word_timestamps)
+
+  # Shift chunk-local timestamps to the global timeline
+  for segment in result['segments']:
+    segment['start'] += offset_seconds
+    segment['end'] += offset_seconds
+    for word in segment.get('words') or []:
+      word['start'] += offset_seconds
+      word['end'] += offset_seconds
+  return result
+
+def stitch_results(results):
+  """Merge per-chunk results into one result dict with the shape Export.generate_srt consumes"""
+  segments = []
+  for result in results:
+    for segment in result['segments']:
+      segment['id'] = len(segments)
+      segments.append(segment)
+
+  return {
+    'text': ''.join(result['text'] for result in results),
+    'segments': segments,
+    'language': results[0]['language'] if results else None
+  }
+
+def transcribe_long_form(audio, language="en", model_size=None, chunk_seconds=300, workers=None, backend=None,
+                         word_timestamps=False):
+  """
+  Split 16 kHz audio on silence into chunks of about chunk_seconds, transcribe the
+  chunks in a process pool and stitch the segments back with global timestamps.
+  """
+  workers = workers or max(1, (os.cpu_count() or 1) // 4)
+  threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+
+  bounds = [0] + find_split_points(audio, chunk_seconds) + [len(audio)]
+  chunks = [(audio[start:end], start / SAMPLE_RATE) for start, end in zip(bounds, bounds[1:])]
+  print(f"Transcribing {len(chunks)} chunks on {workers} workers")
+
+  with ProcessPoolExecutor(
+    max_workers=workers,
+    mp_context=multiprocessing.get_context("spawn"),
+    initializer=_init_worker,
+    initargs=(model_size, backend, threads_per_worker)
+  ) as executor:
+    futures = [executor.submit(_transcribe_chunk, chunk, offset, language, model_size, backend, word_timestamps) for chunk, offset in chunks]
+    results = [future.result() for future in futures]
+
+  return stitch_results(results)
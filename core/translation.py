@@ -1,13 +1,100 @@
 import pysrt
+import json
 import asyncio
 import logging
-from .llm import LLM
+import time
+from collections import deque
+from .llm import LLM, count_tokens
+from .translation_memory import TranslationMemory, normalize_text
 import os
 
+# Bump whenever a prompt changes so cached translations are invalidated
+PROMPT_VERSION = "2"
+
+# Per-batch (input, output) token budgets, matched against the model id
+MODEL_TOKEN_BUDGETS = {
+  'gpt-4o': (4000, 8000),
+  'gpt-4.1': (6000, 12000),
+  'claude': (6000, 8000),
+  'gemini': (6000, 8000),
+  'deepseek': (4000, 8000),
+  'llama': (2000, 4000),
+  'mistral': (2000, 4000),
+}
+DEFAULT_TOKEN_BUDGET = (3000, 4000)
+
+# Translations can need noticeably more tokens than the source text
+OUTPUT_EXPANSION = 2.0
+
+# Separator between two items of the JSON batch (", "), on top of the serialized item
+ITEM_SEPARATOR_TOKENS = 1
+
+BATCH_PROMPT = """Translate the "text" of every item in the following JSON array from {from_lang} to {to_lang}.
+Return a JSON array with exactly one {{"id": ..., "text": ...}} item per input item, keeping the same ids.
+Don't translate terms like 'Vibe Coding' or any terms like that that shouldn't be translated also any term or any untranslated term but them between brackets.
+Return only the JSON array without any additional commentary:
+
+{batch_json}"""
+
 class Translation:
-  def __init__(self):
+  def __init__(self, llm=None, memory=None, backend="llm"):
     self.logger = logging.getLogger(__name__)
-    self.llm = LLM()
+    # "llm" translates through OpenRouter, "local" through installed argostranslate models
+    self.backend = backend
+    # Share one LLM between Translation instances so they share its rate limits
+    self.llm = llm or (LLM() if backend == "llm" else None)
+    self.memory = memory or TranslationMemory()
+    self.stats = {}
+    self.requests = 0
+    self.input_tokens = 0
+    self.output_tokens = 0
+    self.parse_failures = 0
+    # Fraction of the model's token budget used per batch, adapted from latency and parse failures
+    self.budget_scale = 1.0
+
+  def token_budget(self, model):
+    input_budget, output_budget = next(
+      (budget for name, budget in MODEL_TOKEN_BUDGETS.items() if model and name in model),
+      DEFAULT_TOKEN_BUDGET
+    )
+    input_budget = int(os.getenv('OPENROUTER_BATCH_INPUT_TOKENS') or input_budget)
+    output_budget = int(os.getenv('OPENROUTER_BATCH_OUTPUT_TOKENS') or output_budget)
+    return input_budget * self.budget_scale, output_budget * self.budget_scale
+
+  def adapt_budget(self, parse_failed, latency):
+    """Shrink batches after parse failures or slow responses, grow them back after clean fast ones"""
+    target_latency = float(os.getenv('OPENROUTER_BATCH_TARGET_LATENCY', '30'))
+    if parse_failed:
+      self.budget_scale = max(0.125, self.budget_scale * 0.5)
+    elif latency > target_latency:
+      self.budget_scale = max(0.125, self.budget_scale * 0.8)
+    else:
+      self.budget_scale = min(1.0, self.budget_scale * 1.25)
+
+  def next_batch(self, queue, token_counts, budget, prompt_tokens=0):
+    """
+    Pop line indices off the queue until the batch would exceed the input or
+    output budget. The fixed prompt counts once against the input budget; the
+    reply repeats the items, so they count against the output budget too.
+    """
+    input_budget, output_budget = budget
+    batch = []
+    used = 0
+    while queue:
+      cost = token_counts[queue[0]]
+      if batch and (prompt_tokens + used + cost > input_budget or (used + cost) * OUTPUT_EXPANSION > output_budget):
+        break
+      batch.append(queue.popleft())
+      used += cost
+    return batch
+
+  async def generate(self, messages, model):
+    """LLM call that keeps per-job request and token counts"""
+    response = await self.llm.generate_response(messages=messages, model=model)
+    self.requests += 1
+    self.input_tokens += sum(count_tokens(message['content'], model) for message in messages)
+    self.output_tokens += count_tokens(response, model)
+    return response
 
   async def translate_text(self, text, from_lang='en', to_lang='ar'):
     try:
@@ -20,74 +107,134 @@ class Translation:
       ]
       
       # Use the LLM to translate
-      translated_text = self.llm.generate_response(
+      translated_text = await self.generate(
         messages=messages,
         model=os.getenv('OPENROUTER_LLM_MODEL')
       )
       
-      return translated_text.strip()
+      return " ".join(translated_text.split())
     except Exception as e:
       self.logger.error(f"Translation failed for text '{text}': {e}")
       raise e
 
-  async def translate_batch(self, texts, from_lang='en', to_lang='ar'):
-    """Translate multiple texts in a single API call"""
+  def parse_batch_response(self, response, ids):
+    """
+    Parse a JSON array of {"id", "text"} items. Returns {id: text} for the valid
+    items; raises ValueError when the response isn't a JSON array, uses ids that
+    weren't sent (e.g. shifted to 0-based) or has no usable item at all.
+    """
+    start, end = response.find('['), response.rfind(']')
+    if start == -1 or end < start:
+      raise ValueError("response contains no JSON array")
+
     try:
-      # Create numbered list of texts for batch translation
-      numbered_texts = []
-      for i, text in enumerate(texts, 1):
-        numbered_texts.append(f"{i}. {text}")
-      
-      batch_text = "\n".join(numbered_texts)
-      
-      messages = [
-        {
-          "role": "user",
-          "content": f"""Translate the following numbered list from {from_lang} to {to_lang}. 
-Return the translations in the exact same numbered format, maintaining the same numbering.
-Don't translate terms like 'Vibe Coding' or any terms like that that shouldn't be translated also any term or any untranslated term but them between brackets.
-Return only the translated numbered list without any additional commentary:
+      # strict=False accepts raw line breaks inside strings, which models sometimes emit
+      items = json.loads(response[start:end + 1], strict=False)
+    except json.JSONDecodeError as e:
+      raise ValueError(f"invalid JSON: {e}")
+    if not isinstance(items, list):
+      raise ValueError("response is not a JSON array")
 
-{batch_text}"""
-        }
-      ]
-      
-      # Use the LLM to translate the batch
-      translated_batch = self.llm.generate_response(
-        messages=messages,
-        model=os.getenv('OPENROUTER_LLM_MODEL')
+    translations = {}
+    for item in items:
+      if not isinstance(item, dict):
+        continue
+      item_id, text = item.get('id'), item.get('text')
+      if isinstance(item_id, str) and item_id.isdigit():
+        item_id = int(item_id)
+      if item_id not in ids:
+        raise ValueError(f"unexpected id {item_id!r}")
+      if item_id not in translations and isinstance(text, str) and text.strip():
+        # One line per subtitle: line breaks inside a translation would split it in the text output
+        translations[item_id] = " ".join(text.split())
+    if not translations:
+      raise ValueError("no usable items")
+    return translations
+
+  async def translate_batch(self, texts, from_lang='en', to_lang='ar'):
+    """
+    Translate multiple texts in a single API call as a JSON array with ids.
+
+    Ids missing from an otherwise valid response are retried on their own; a
+    response that can't be parsed, has unknown ids or no usable item is bisected,
+    so one bad line costs O(log n) extra calls.
+    """
+    if len(texts) == 1:
+      return [await self.translate_text(texts[0], from_lang, to_lang)]
+
+    ids = list(range(1, len(texts) + 1))
+    batch_json = json.dumps([{"id": i, "text": text} for i, text in zip(ids, texts)], ensure_ascii=False)
+    
+    messages = [
+      {
+        "role": "user",
+        "content": BATCH_PROMPT.format(from_lang=from_lang, to_lang=to_lang, batch_json=batch_json)
+      }
+    ]
+    
+    # Use the LLM to translate the batch
+    response = await self.generate(
+      messages=messages,
+      model=os.getenv('OPENROUTER_LLM_MODEL')
+    )
+    
+    try:
+      translations = self.parse_batch_response(response, set(ids))
+    except ValueError as e:
+      self.parse_failures += 1
+      self.logger.warning(f"Unusable batch response ({e}), bisecting {len(texts)} lines")
+      middle = len(texts) // 2
+      first_half, second_half = await asyncio.gather(
+        self.translate_batch(texts[:middle], from_lang, to_lang),
+        self.translate_batch(texts[middle:], from_lang, to_lang)
       )
-      
-      # Parse the numbered response back into individual translations
-      translated_lines = translated_batch.strip().split('\n')
-      translations = []
-      
-      for line in translated_lines:
-        if line.strip() and '. ' in line:
-          # Remove the number prefix and get the translation
-          translation = line.split('. ', 1)[1] if '. ' in line else line
-          translations.append(translation.strip())
-      
-      # Ensure we have the same number of translations as inputs
-      if len(translations) != len(texts):
-        self.logger.warning(f"Expected {len(texts)} translations, got {len(translations)}. Falling back to individual translation.")
-        # Fallback to individual translation if batch parsing fails
-        individual_translations = []
-        for text in texts:
-          translation = await self.translate_text(text, from_lang, to_lang)
-          individual_translations.append(translation)
-        return individual_translations
-      
-      return translations
-      
-    except Exception as e:
-      self.logger.error(f"Batch translation failed: {e}")
-      # Fallback to individual translation
-      individual_translations = []
-      for text in texts:
-        translation = await self.translate_text(text, from_lang, to_lang)
-        individual_translations.append(translation)
-      return individual_translations
+      return first_half + second_half
+    
+    # Strictly fewer lines than this batch, since at least one item was usable
+    missing = [i for i in ids if i not in translations]
+    if missing:
+      self.parse_failures += 1
+      self.logger.warning(f"Batch response is missing {len(missing)} of {len(texts)} ids, retrying those")
+      retried = await self.translate_batch([texts[i - 1] for i in missing], from_lang, to_lang)
+      translations.update(zip(missing, retried))
+    
+    return [translations[i] for i in ids]
+
+  async def translate_lines_with_llm(self, texts, from_language, target_language, model):
+    # Batches are packed by token count against the model's budget. Workers pull the
+    # next batch when they're free, so later batches use the adapted budget; the LLM
+    # client enforces the in-flight and rate limits.
+    # Each line costs its serialized JSON item; ids are at most len(texts), so that id is a safe upper bound
+    token_counts = [
+      count_tokens(json.dumps({"id": len(texts), "text": text}, ensure_ascii=False), model) + ITEM_SEPARATOR_TOKENS
+      for text in texts
+    ]
+    prompt_tokens = count_tokens(BATCH_PROMPT.format(from_lang=from_language, to_lang=target_language, batch_json="[]"), model)
+    queue = deque(range(len(texts)))
+    translations = [None] * len(texts)
+    
+    async def translate_next_batches():
+      while queue:
+        batch = self.next_batch(queue, token_counts, self.token_budget(model), prompt_tokens)
+        parse_failures = self.parse_failures
+        start = time.perf_counter()
+        batch_translations = await self.translate_batch([texts[i] for i in batch], from_language, target_language)
+        self.adapt_budget(self.parse_failures > parse_failures, time.perf_counter() - start)
+        for i, translation in zip(batch, batch_translations):
+          translations[i] = translation
+    
+    await asyncio.gather(*(translate_next_batches() for _ in range(self.llm.max_in_flight)))
+    return translations
+
+  def report(self):
+    """Print the translation memory and API usage of the last translate_srt job"""
+    if not self.stats:
+      print("Translation: no job run")
+      return
+    print(f"Translation memory ({self.stats['languages']}): {self.stats['memory_hits']}/{self.stats['lines']} lines "
+          f"({self.stats['hit_rate']:.0%} hit rate), ~{self.stats['tokens_saved']} tokens saved")
+    print(f"Translated {self.stats['lines']} subtitles using {self.stats['requests']} API requests "
+          f"({self.stats['input_tokens']} input / {self.stats['output_tokens']} output tokens)")
 
   async def translate_srt(self, srt_path, from_language, target_language, output_path, output_text_path=None):
     try:
@@ -95,22 +242,42 @@ Return only the translated numbered list without any additional commentary:
       
       # Extract all subtitle texts
       subtitle_texts = [sub.text for sub in subs]
+      normalized_texts = [normalize_text(text) for text in subtitle_texts]
+      model = os.getenv('OPENROUTER_LLM_MODEL') if self.backend == "llm" else "argostranslate"
+      
+      # Look every line up in the translation memory first; only misses go to the LLM
+      known = self.memory.lookup(subtitle_texts, from_language, target_language, model, PROMPT_VERSION)
+      missing = {}
+      for text, normalized in zip(subtitle_texts, normalized_texts):
+        if normalized not in known and normalized not in missing:
+          missing[normalized] = text
+      missing_texts = list(missing.values())
       
-      # Define batch size (adjust based on model's context limit)
-      batch_size = 30  # Process 30 subtitles at a time
+      self.requests = self.input_tokens = self.output_tokens = 0
+      
+      if self.backend == "local":
+        from .local_translation import translate_lines
+
+        # All misses go through one batched CTranslate2 call, off the event loop
+        translations = await asyncio.to_thread(translate_lines, missing_texts, from_language, target_language)
+      else:
+        translations = await self.translate_lines_with_llm(missing_texts, from_language, target_language, model)
       
-      all_translations = []
+      new_translations = dict(zip(missing_texts, translations))
+      self.memory.store(new_translations, from_language, target_language, model, PROMPT_VERSION)
+      known.update((normalize_text(text), translation) for text, translation in new_translations.items())
       
-      # Process subtitles in batches
-      for i in range(0, len(subtitle_texts), batch_size):
-        batch = subtitle_texts[i:i + batch_size]
-        batch_translations = await self.translate_batch(batch, from_language, target_language)
-        all_translations.extend(batch_translations)
-        
-        # Optional: Add small delay between batches to avoid rate limiting
-        if i + batch_size < len(subtitle_texts):
-          await asyncio.sleep(0.5)  # 500ms delay between batches
+      all_translations = [known[normalized] for normalized in normalized_texts]
       
+      hits = [text for text, normalized in zip(subtitle_texts, normalized_texts) if normalized not in missing]
+      self.stats = {
+        'languages': f"{from_language} -> {target_language}",
+        'lines': len(subtitle_texts),
+        'memory_hits': len(hits),
+        'hit_rate': len(hits) / len(subtitle_texts) if subtitle_texts else 0,
+        # Prompt plus a completion about as long, as in LLM.estimate_tokens
+        'tokens_saved': 2 * sum(count_tokens(text, model) for text in hits)
+      }
       # Apply translations back to subtitles
       for i, sub in enumerate(subs):
         if i < len(all_translations):
@@ -123,7 +290,11 @@ Return only the translated numbered list without any additional commentary:
           for i, sub in enumerate(subs):
             f.write(sub.text + "\n")
       
-      self.logger.info(f"Translated {len(subs)} subtitles using {(len(subtitle_texts) + batch_size - 1) // batch_size} API requests")
+      self.stats.update({
+        'requests': self.requests,
+        'input_tokens': self.input_tokens,
+        'output_tokens': self.output_tokens
+      })
       
       return output_path
     except Exception as e:
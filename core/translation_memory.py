@@ -0,0 +1,65 @@
+import os
+import re
+import sqlite3
+import unicodedata
+
+def normalize_text(text):
+  """Key form of a subtitle line: NFC, collapsed whitespace, trimmed"""
+  return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+
+class TranslationMemory:
+  """
+  Persistent translation memory in a local SQLite file (WAL mode).
+
+  Entries are keyed on (normalized source text, from_lang, to_lang, model, prompt version).
+  """
+  # Stay well below SQLite's bound-parameter limit
+  LOOKUP_CHUNK = 500
+
+  def __init__(self, path=None):
+    self.path = path or os.getenv("TRANSLATION_MEMORY_PATH", "temp/translation_memory.sqlite3")
+    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+    self.connection = sqlite3.connect(self.path, check_same_thread=False)
+    self.connection.execute("PRAGMA journal_mode=WAL")
+    self.connection.execute("PRAGMA synchronous=NORMAL")
+    self.connection.execute("""
+      CREATE TABLE IF NOT EXISTS translations (
+        source TEXT NOT NULL,
+        from_lang TEXT NOT NULL,
+        to_lang TEXT NOT NULL,
+        model TEXT NOT NULL,
+        prompt_version TEXT NOT NULL,
+        translation TEXT NOT NULL,
+        PRIMARY KEY (source, from_lang, to_lang, model, prompt_version)
+      ) WITHOUT ROWID
+    """)
+    self.connection.commit()
+
+  def lookup(self, texts, from_lang, to_lang, model, prompt_version):
+    """Bulk lookup; returns {normalized text: translation} for the texts found"""
+    sources = list(dict.fromkeys(normalize_text(text) for text in texts))
+    found = {}
+    for i in range(0, len(sources), self.LOOKUP_CHUNK):
+      chunk = sources[i:i + self.LOOKUP_CHUNK]
+      placeholders = ",".join("?" * len(chunk))
+      rows = self.connection.execute(
+        f"""SELECT source, translation FROM translations
+            WHERE from_lang = ? AND to_lang = ? AND model = ? AND prompt_version = ?
+            AND source IN ({placeholders})""",
+        [from_lang, to_lang, model or "", prompt_version, *chunk]
+      )
+      found.update(rows)
+    return found
+
+  def store(self, translations, from_lang, to_lang, model, prompt_version):
+    """Store {source text: translation} pairs"""
+    self.connection.executemany(
+      "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?)",
+      [(normalize_text(source), from_lang, to_lang, model or "", prompt_version, translation)
+       for source, translation in translations.items()]
+    )
+    self.connection.commit()
+
+  def close(self):
+    self.connection.close()
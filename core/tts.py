@@ -0,0 +1,314 @@
+import os
+import time
+import json
+import shutil
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import torchaudio as ta
+from chatterbox.tts import ChatterboxTTS
+from .audio import Audio
+
+MODEL_ID = "ResembleAI/chatterbox"
+
+def file_sha256(path):
+  digest = hashlib.sha256()
+  with open(path, "rb") as f:
+    for block in iter(lambda: f.read(1024 * 1024), b""):
+      digest.update(block)
+  return digest.hexdigest()
+
+class TTSCache:
+  """
+  Content-addressed cache of synthesized lines.
+
+  Entries are keyed on a hash of (line text, reference-voice audio, model id,
+  generation parameters) and evicted least-recently-used once the cache
+  directory grows past max_bytes. The directory size is tracked as a running
+  total, so the directory is only scanned on the first store and on eviction.
+  """
+  def __init__(self, cache_dir=None, max_bytes=None):
+    self.cache_dir = cache_dir or os.getenv("TTS_CACHE_DIR", "temp/tts_cache")
+    self.max_bytes = max_bytes or int(os.getenv("TTS_CACHE_MAX_MB", "2048")) * 1024 * 1024
+    self.hits = 0
+    self.misses = 0
+    self.total_bytes = None
+    os.makedirs(self.cache_dir, exist_ok=True)
+
+  def key(self, text, reference_hash, params):
+    payload = json.dumps({
+      "text": text,
+      "reference": reference_hash,
+      "model": MODEL_ID,
+      "params": params
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+  def path(self, key):
+    return os.path.join(self.cache_dir, f"{key}.wav")
+
+  def restore(self, keys, output_paths):
+    """Copy cached entries to their output paths; returns the indices that still need synthesis"""
+    missing = []
+    for i, (key, output_path) in enumerate(zip(keys, output_paths)):
+      cached_path = self.path(key)
+      if os.path.exists(cached_path):
+        shutil.copyfile(cached_path, output_path)
+        os.utime(cached_path)  # mark as recently used
+        self.hits += 1
+      else:
+        missing.append(i)
+        self.misses += 1
+    return missing
+
+  def entries(self):
+    entries = []
+    for name in os.listdir(self.cache_dir):
+      if name.endswith(".wav"):
+        stat = os.stat(os.path.join(self.cache_dir, name))
+        entries.append((stat.st_mtime, stat.st_size, name))
+    return entries
+
+  def store(self, key, wav_path):
+    if self.total_bytes is None:
+      self.total_bytes = sum(size for _, size, _ in self.entries())
+
+    cached_path = self.path(key)
+    replaced = os.path.getsize(cached_path) if os.path.exists(cached_path) else 0
+    tmp_path = cached_path + ".tmp"
+    shutil.copyfile(wav_path, tmp_path)
+    os.replace(tmp_path, cached_path)
+    self.total_bytes += os.path.getsize(cached_path) - replaced
+
+    if self.total_bytes > self.max_bytes:
+      self.evict()
+
+  def evict(self):
+    # Down to 90% of the limit, so the next few stores don't each trigger a full scan
+    entries = self.entries()
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+      if total <= self.max_bytes * 0.9:
+        break
+      os.remove(os.path.join(self.cache_dir, name))
+      total -= size
+    self.total_bytes = total
+
+  def report(self):
+    total = self.hits + self.misses
+    print(f"TTS cache: {self.hits} hits, {self.misses} misses ({self.hits / total:.0%} hit rate)" if total else "TTS cache: unused")
+
+class TTSEngine:
+  """
+  Persistent Chatterbox TTS engine.
+
+  Lifecycle: load() -> warm_up() -> generate()/generate_many() -> close().
+  The model is loaded once and the speaker conditioning is computed once from
+  the reference audio, then reused for every generated line.
+  """
+  def __init__(self, reference_audio_path, device="cpu", exaggeration=0.5, cfg_weight=0.5, temperature=0.8, cache=None):
+    self.reference_audio_path = reference_audio_path
+    self.device = device
+    self.exaggeration = exaggeration
+    self.cfg_weight = cfg_weight
+    self.temperature = temperature
+    self.cache = cache
+    self.model = None
+
+  def generation_params(self):
+    return {
+      "exaggeration": self.exaggeration,
+      "cfg_weight": self.cfg_weight,
+      "temperature": self.temperature
+    }
+
+  def load(self):
+    import torch
+
+    if self.model is not None:
+      return self
+
+    if not os.path.exists(self.reference_audio_path):
+      raise FileNotFoundError(f"Audio file not found: {self.reference_audio_path}")
+
+    reference_audio_path = self.reference_audio_path
+    if reference_audio_path.endswith(".mp3"):
+      reference_audio_path = Audio().convert_mp3_to_wav(reference_audio_path)
+
+    # Monkey patch torch.load to force CPU loading
+    original_load = torch.load
+    def cpu_load(*args, **kwargs):
+        kwargs['map_location'] = torch.device('cpu')
+        return original_load(*args, **kwargs)
+
+    torch.load = cpu_load
+
+    try:
+        self.model = ChatterboxTTS.from_pretrained(device=self.device)
+    finally:
+        # Restore original torch.load
+        torch.load = original_load
+
+    # Speaker conditioning is computed once and reused by every generate() call
+    self.model.prepare_conditionals(reference_audio_path, exaggeration=self.exaggeration)
+    return self
+
+  def warm_up(self, text="Hello."):
+    """Run one throwaway generation so the first real line doesn't pay for lazy initialization"""
+    self.load()
+    self._generate_wav(text)
+    return self
+
+  def _generate_wav(self, text):
+    return self.model.generate(
+      text,
+      exaggeration=self.exaggeration,
+      cfg_weight=self.cfg_weight,
+      temperature=self.temperature
+    )
+
+  def generate(self, text, output_path):
+    self.load()
+    wav = self._generate_wav(text)
+    ta.save(output_path, wav, self.model.sr)
+    return output_path
+
+  def generate_many(self, lines, output_dir, prefix="translated_audio"):
+    """Generate one WAV per line as {output_dir}/{prefix}_{i}.wav, in line order"""
+    os.makedirs(output_dir, exist_ok=True)
+    output_paths = [os.path.join(output_dir, f"{prefix}_{i}.wav") for i in range(len(lines))]
+
+    keys = None
+    pending = range(len(lines))
+    if self.cache:
+      reference_hash = file_sha256(self.reference_audio_path)
+      keys = [self.cache.key(line, reference_hash, self.generation_params()) for line in lines]
+      pending = self.cache.restore(keys, output_paths)
+
+    # The model is only loaded when at least one line misses the cache
+    if pending:
+      self.warm_up()
+
+    for i in pending:
+      self.generate(lines[i], output_paths[i])
+      if keys:
+        self.cache.store(keys[i], output_paths[i])
+      print(output_paths[i])
+    return output_paths
+
+  def close(self):
+    self.model = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    self.close()
+
+
+# Per-process engine used by TTSWorkerPool workers
+_worker_engine = None
+
+def _init_worker(reference_audio_path, engine_kwargs, threads_per_worker):
+  import torch
+  global _worker_engine
+
+  # Each worker gets its own slice of the cores to avoid oversubscription
+  torch.set_num_threads(threads_per_worker)
+  torch.set_num_interop_threads(1)
+
+  _worker_engine = TTSEngine(reference_audio_path, **engine_kwargs)
+  _worker_engine.warm_up()
+
+def _generate_line(index, text, output_path):
+  start = time.perf_counter()
+  _worker_engine.generate(text, output_path)
+  return index, output_path, time.perf_counter() - start
+
+class TTSWorkerPool:
+  """
+  Parallel TTS generation over a bounded pool of worker processes.
+
+  Every worker holds its own loaded Chatterbox model and cached speaker
+  conditioning. Exposes the same lifecycle as TTSEngine.
+  """
+  def __init__(self, reference_audio_path, workers=None, threads_per_worker=None, cache=None, **engine_kwargs):
+    cpu_count = os.cpu_count() or 1
+    self.reference_audio_path = reference_audio_path
+    self.workers = max(1, workers or cpu_count // 4)
+    self.threads_per_worker = max(1, threads_per_worker or cpu_count // self.workers)
+    self.cache = cache
+    self.engine_kwargs = engine_kwargs
+    self.executor = None
+    self.latencies = {}
+
+  def load(self):
+    if self.executor is not None:
+      return self
+
+    if not os.path.exists(self.reference_audio_path):
+      raise FileNotFoundError(f"Audio file not found: {self.reference_audio_path}")
+
+    # Convert once here so the workers don't race on the same temp file
+    reference_audio_path = self.reference_audio_path
+    if reference_audio_path.endswith(".mp3"):
+      reference_audio_path = Audio().convert_mp3_to_wav(reference_audio_path)
+
+    self.executor = ProcessPoolExecutor(
+      max_workers=self.workers,
+      mp_context=multiprocessing.get_context("spawn"),
+      initializer=_init_worker,
+      initargs=(reference_audio_path, self.engine_kwargs, self.threads_per_worker)
+    )
+    return self
+
+  def warm_up(self):
+    """Workers load and warm up their model in the pool initializer"""
+    return self.load()
+
+  def generate_many(self, lines, output_dir, prefix="translated_audio"):
+    """Generate one WAV per line as {output_dir}/{prefix}_{i}.wav, returned in line order"""
+    os.makedirs(output_dir, exist_ok=True)
+    output_paths = [os.path.join(output_dir, f"{prefix}_{i}.wav") for i in range(len(lines))]
+
+    keys = None
+    pending = range(len(lines))
+    if self.cache:
+      reference_hash = file_sha256(self.reference_audio_path)
+      params = TTSEngine(self.reference_audio_path, **self.engine_kwargs).generation_params()
+      keys = [self.cache.key(line, reference_hash, params) for line in lines]
+      pending = self.cache.restore(keys, output_paths)
+
+    if not pending:
+      return output_paths
+
+    # Workers are only started when at least one line misses the cache
+    self.load()
+    futures = [self.executor.submit(_generate_line, i, lines[i], output_paths[i]) for i in pending]
+
+    for future in as_completed(futures):
+      index, output_path, latency = future.result()
+      if keys:
+        self.cache.store(keys[index], output_path)
+      self.latencies[index] = latency
+      print(f"{output_path} ({latency:.2f}s)")
+
+    if self.latencies:
+      latencies = sorted(self.latencies.values())
+      print(f"Generated {len(pending)} lines on {self.workers} workers: "
+            f"mean {sum(latencies) / len(latencies):.2f}s, max {latencies[-1]:.2f}s per line")
+
+    return output_paths
+
+  def close(self, cancel_pending=False):
+    """Stop the workers; with cancel_pending, queued lines are dropped instead of synthesized"""
+    if self.executor is not None:
+      self.executor.shutdown(cancel_futures=cancel_pending)
+      self.executor = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    # A failed line shouldn't wait for the rest of the queue before surfacing
+    self.close(cancel_pending=exc_type is not None)
@@ -1,17 +1,33 @@
 import ffmpeg
 import os
+import time
+import subprocess
+import numpy as np
 import pysubs2
 import re
+from concurrent.futures import ThreadPoolExecutor
 
 class GenerateVideo:
-    def __init__(self, video, subtitles=None, lang='en', title='', audio=None, output_file="output.mp4"):
+    def __init__(self, video, subtitles=None, lang='en', title='', audio=None, output_file="output.mp4",
+                 audio_samples=None, audio_sample_rate=44100, scale=None,
+                 render_chunks=1, x264_preset='medium'):
         self.video = video
         self.subtitles = subtitles
         self.lang = lang
         self.title = title
         self.audio = audio
+        # Optional in-memory (frames, channels) float32 track piped straight into the mux
+        self.audio_samples = audio_samples
+        self.audio_sample_rate = audio_sample_rate
+        # Optional FFmpeg scale expression, e.g. "1280:-2"
+        self.scale = scale
+        # Number of keyframe-aligned ranges encoded in parallel for subtitle burn-in
+        self.render_chunks = render_chunks
+        self.x264_preset = x264_preset
         self.output_file = output_file
         self.ass_file = f"temp/temp_subs_{self.lang}.ass" if subtitles else None
+        self.chunk_files = []
+        self.concat_list = None
         
     def is_rtl_language(self):
         rtl_languages = ['ar', 'he', 'fa', 'ur', 'yi', 'iw', 'ji', 'ps', 'sd']
@@ -72,17 +88,143 @@ class GenerateVideo:
 
         subs.save(ass_file)
 
+    def needs_video_reencode(self):
+        """Only a subtitle burn-in or a scale changes the frames; anything else is a remux."""
+        return bool(self.subtitles or self.scale)
+
+    def apply_video_filters(self, video_stream, ass_file=None, font_config=None):
+        if ass_file:
+            subtitle_filter_args = {'fontsdir': font_config['fontsdir']} if font_config['fontsdir'] else {}
+
+            video_stream = ffmpeg.filter(
+                video_stream,
+                'subtitles',
+                ass_file,
+                **subtitle_filter_args
+            )
+
+        if self.scale:
+            video_stream = ffmpeg.filter(video_stream, 'scale', self.scale)
+
+        return video_stream
+
+    def get_keyframe_times(self):
+        """Keyframe timestamps of the first video stream, read from packet flags (no decoding)."""
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'v:0',
+            '-show_entries', 'packet=pts_time,flags',
+            '-of', 'csv=p=0',
+            self.video
+        ]
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+
+        keyframes = []
+        for line in result.stdout.splitlines():
+            parts = line.split(',')
+            if len(parts) >= 2 and 'K' in parts[1] and parts[0] not in ('', 'N/A'):
+                keyframes.append(float(parts[0]))
+        return sorted(keyframes)
+
+    def get_chunk_ranges(self, chunks):
+        """Split the timeline into (start, end) ranges that start on keyframes near equal-length cut points."""
+        duration = float(ffmpeg.probe(self.video)['format']['duration'])
+        keyframes = self.get_keyframe_times()
+
+        cuts = [0.0]
+        for k in range(1, chunks):
+            target = duration * k / chunks
+            candidates = [t for t in keyframes if t > cuts[-1]]
+            if not candidates:
+                break
+            cut = min(candidates, key=lambda t: abs(t - target))
+            if cut < duration:
+                cuts.append(cut)
+
+        return list(zip(cuts, cuts[1:] + [duration]))
+
+    def write_chunk_subtitles(self, start, end, chunk_index):
+        """Shift the ASS events so they line up with a chunk whose timestamps restart at zero."""
+        subs = pysubs2.load(self.ass_file, encoding="utf-8")
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+
+        subs.events = [line for line in subs.events if line.end > start_ms and line.start < end_ms]
+        subs.shift(ms=-start_ms)
+
+        chunk_ass_file = f"temp/temp_subs_{self.lang}_{chunk_index}.ass"
+        subs.save(chunk_ass_file)
+        return chunk_ass_file
+
+    def render_chunk(self, start, end, chunk_index, font_config, threads):
+        # A scale-only re-encode has no subtitles to shift
+        chunk_ass_file = self.write_chunk_subtitles(start, end, chunk_index) if self.subtitles else None
+        chunk_file = os.path.abspath(f"temp/chunk_{self.lang}_{chunk_index}.mp4")
+
+        video_stream = ffmpeg.input(self.video, ss=start, t=end - start)['v']
+        video_stream = self.apply_video_filters(video_stream, chunk_ass_file, font_config)
+
+        output_ffmpeg = ffmpeg.output(
+            video_stream,
+            chunk_file,
+            vcodec='libx264',
+            preset=self.x264_preset,
+            threads=threads
+        )
+
+        chunk_start = time.perf_counter()
+        ffmpeg.run(ffmpeg.overwrite_output(output_ffmpeg), quiet=True)
+        print(f"Chunk {chunk_index} ({start:.2f}s - {end:.2f}s) encoded in {time.perf_counter() - chunk_start:.1f}s")
+
+        if chunk_ass_file:
+            os.remove(chunk_ass_file)
+        return chunk_file
+
+    def render_chunks_parallel(self, font_config):
+        """
+        Burn the subtitles (and/or scale) into keyframe-aligned ranges in parallel FFmpeg processes
+        and join the encoded chunks losslessly with the concat demuxer.
+
+        Returns the concatenated video stream, ready to be stream-copied.
+        """
+        os.makedirs('temp', exist_ok=True)
+        ranges = self.get_chunk_ranges(self.render_chunks)
+        threads = max(1, (os.cpu_count() or 1) // len(ranges))
+
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            chunk_files = list(executor.map(
+                lambda args: self.render_chunk(*args, font_config, threads),
+                [(start, end, i) for i, (start, end) in enumerate(ranges)]
+            ))
+
+        self.chunk_files = chunk_files
+        self.concat_list = f"temp/chunks_{self.lang}.txt"
+        with open(self.concat_list, 'w', encoding='utf-8') as f:
+            for chunk_file in chunk_files:
+                f.write(f"file '{chunk_file}'\n")
+
+        return ffmpeg.input(self.concat_list, format='concat', safe=0)['v']
+
     def generate_video(self):
         input_video = ffmpeg.input(self.video)
         
         # Handle audio input
-        if self.audio:
+        if self.audio_samples is not None:
+            input_audio = ffmpeg.input(
+                'pipe:',
+                format='f32le',
+                ac=self.audio_samples.shape[1],
+                ar=self.audio_sample_rate
+            )
+            audio_stream = input_audio['a']
+        elif self.audio:
             input_audio = ffmpeg.input(self.audio)
             audio_stream = input_audio['a']
         else:
             audio_stream = input_video['a']
         
         # Handle subtitles
+        font_config = None
         if self.subtitles:
             font_config = self.get_font_config()
             is_rtl = self.is_rtl_language()
@@ -92,22 +234,26 @@ class GenerateVideo:
             
             self.convert_srt_to_ass(self.subtitles, self.ass_file, font_config, is_rtl)
 
-            subtitle_filter_args = {'fontsdir': font_config['fontsdir']} if font_config['fontsdir'] else {}
-
-            video_stream = ffmpeg.filter(
-                input_video['v'],
-                'subtitles',
-                self.ass_file,
-                **subtitle_filter_args
-            )
+        parallel_render = self.needs_video_reencode() and self.render_chunks > 1
+        if parallel_render:
+            video_stream = self.render_chunks_parallel(font_config)
         else:
-            video_stream = input_video['v']
+            video_stream = self.apply_video_filters(input_video['v'], self.ass_file, font_config)
 
         # Create output with metadata if title is provided
         output_args = {
-            'vcodec': 'libx264',
+            'vcodec': 'copy',
             'acodec': 'copy'
         }
+
+        if self.needs_video_reencode() and not parallel_render:
+            output_args['vcodec'] = 'libx264'
+            output_args['preset'] = self.x264_preset
+
+        # A replaced audio track is encoded to AAC once; PCM can't be copied into MP4
+        if self.audio_samples is not None or self.audio:
+            output_args['acodec'] = 'aac'
+            output_args['audio_bitrate'] = '192k'
         
         if self.title:
             output_args['metadata'] = f'title={self.title}'
@@ -120,8 +266,32 @@ class GenerateVideo:
 
         output_ffmpeg = ffmpeg.overwrite_output(output_ffmpeg)
         print(ffmpeg.compile(output_ffmpeg))
-        ffmpeg.run(output_ffmpeg)
+
+        if self.audio_samples is not None:
+            self.run_with_piped_audio(output_ffmpeg)
+        else:
+            ffmpeg.run(output_ffmpeg)
+
+    def run_with_piped_audio(self, output_ffmpeg, block_seconds=1):
+        """Stream the in-memory audio track into FFmpeg's stdin block by block."""
+        process = ffmpeg.run_async(output_ffmpeg, pipe_stdin=True)
+        block_frames = int(self.audio_sample_rate * block_seconds)
+
+        try:
+            for start in range(0, len(self.audio_samples), block_frames):
+                block = np.clip(self.audio_samples[start:start + block_frames], -1.0, 1.0)
+                process.stdin.write(block.astype(np.float32).tobytes())
+        except BrokenPipeError:
+            pass  # FFmpeg exited early, the return code below reports why
+        finally:
+            process.stdin.close()
+
+        if process.wait() != 0:
+            raise ffmpeg.Error('ffmpeg', None, None)
 
     def cleanup_temp_files(self):
         if self.ass_file and os.path.exists(self.ass_file):
-            os.remove(self.ass_file)
\ No newline at end of file
+            os.remove(self.ass_file)
+        for temp_file in self.chunk_files + ([self.concat_list] if self.concat_list else []):
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
\ No newline at end of file
@@ -1,12 +1,26 @@
+import json
+import os
+import zipfile
 import argostranslate.package
 import argostranslate.translate
 
-def install_language_package(from_code, to_code):
+def is_package_installed(from_code, to_code):
+    return any(
+        package.from_code == from_code and package.to_code == to_code
+        for package in argostranslate.package.get_installed_packages()
+    )
+
+def install_language_package(from_code, to_code, update_index=False):
     """Install a specific language package for argostranslate"""
+    if is_package_installed(from_code, to_code):
+        print(f"{from_code} -> {to_code} package already installed")
+        return True
+
     print(f"Installing {from_code} -> {to_code} translation package...")
     
-    # Update package index
-    argostranslate.package.update_package_index()
+    # Only refresh the package index when asked to (get_available_packages fetches it if it's missing)
+    if update_index:
+        argostranslate.package.update_package_index()
     available_packages = argostranslate.package.get_available_packages()
     
     # Find the specific package
@@ -15,6 +29,10 @@ def install_language_package(from_code, to_code):
         None
     )
     
+    if package_to_install is None and not update_index:
+        # The cached index may be stale, refresh it once and retry
+        return install_language_package(from_code, to_code, update_index=True)
+
     if package_to_install is None:
         print(f"Package {from_code} -> {to_code} not found!")
         return False
@@ -28,6 +46,34 @@ def install_language_package(from_code, to_code):
         print(f"Error installing package: {e}")
         return False
 
+def read_package_codes(package_path):
+    """Read (from_code, to_code) from the metadata.json inside a .argosmodel archive"""
+    with zipfile.ZipFile(package_path) as archive:
+        metadata_name = next(name for name in archive.namelist() if name.endswith("metadata.json"))
+        metadata = json.loads(archive.read(metadata_name))
+    return metadata.get("from_code"), metadata.get("to_code")
+
+def install_packages_from_directory(directory):
+    """Install every .argosmodel file in a local directory (no network), skipping installed pairs"""
+    installed = 0
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".argosmodel"):
+            continue
+
+        package_path = os.path.join(directory, file_name)
+        from_code, to_code = read_package_codes(package_path)
+        if is_package_installed(from_code, to_code):
+            print(f"{from_code} -> {to_code} package already installed")
+            continue
+
+        try:
+            argostranslate.package.install_from_path(package_path)
+            print(f"Successfully installed {from_code} -> {to_code} package from {file_name}")
+            installed += 1
+        except Exception as e:
+            print(f"Error installing {file_name}: {e}")
+    return installed
+
 def test_translation(from_code, to_code, test_text="Hello World"):
     """Test if translation works"""
     try:
@@ -39,6 +85,11 @@ def test_translation(from_code, to_code, test_text="Hello World"):
         return False
 
 if __name__ == "__main__":
+    # Air-gapped nodes: install from a local directory of .argosmodel files instead
+    local_package_dir = os.getenv("ARGOS_PACKAGE_DIR")
+    if local_package_dir:
+        install_packages_from_directory(local_package_dir)
+
     # Install English to French package (as used in app.py)
     from_code = "en"
     to_code = "fr"
@@ -46,4 +97,4 @@ if __name__ == "__main__":
     if install_language_package(from_code, to_code):
         test_translation(from_code, to_code)
     else:
-        print("Failed to install language package!")
\ No newline at end of file
+        print("Failed to install language package!")
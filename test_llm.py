@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Test script for the batched LLM translation path against a local stand-in for
+the OpenRouter chat completions endpoint
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import tempfile
+import threading
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from core.llm import LLM
+from core.translation import Translation
+from core.translation_memory import TranslationMemory
+
+class StubServer(BaseHTTPRequestHandler):
+  """Answers the first `rate_limited` requests with 429, then every batch with its items reversed after a random delay"""
+  lock = threading.Lock()
+  rate_limited = 2
+  requests = 0
+  in_flight = 0
+  max_in_flight = 0
+
+  def log_message(self, *args):
+    pass
+
+  def do_POST(self):
+    body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+    cls = type(self)
+    with cls.lock:
+      cls.requests += 1
+      limited = cls.requests <= cls.rate_limited
+      cls.in_flight += 1
+      cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+
+    try:
+      if limited:
+        self.reply(429, {"error": {"message": "rate limited"}}, {"retry-after": "0"})
+        return
+
+      # Random latency so batches finish out of order, items answered in reverse order
+      time.sleep(random.uniform(0.01, 0.05))
+      prompt = body["messages"][0]["content"]
+      if "[" in prompt:
+        items = json.loads(prompt[prompt.index("["):])
+        content = json.dumps([{"id": item["id"], "text": f"T:{item['text']}"} for item in reversed(items)])
+      else:
+        # Single-line batches use the plain text prompt
+        content = "T:" + prompt.split("\n\n", 1)[1]
+      self.reply(200, {
+        "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}]
+      })
+    finally:
+      with cls.lock:
+        cls.in_flight -= 1
+
+  def reply(self, status, payload, headers=None):
+    data = json.dumps(payload).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    for name, value in (headers or {}).items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(data)
+
+def test_batched_translation_against_stub_server():
+  # Small batches, so there are many more of them than requests in flight
+  environment = {"OPENROUTER_API_KEY": "test", "OPENROUTER_BATCH_INPUT_TOKENS": "200", "OPENROUTER_BATCH_OUTPUT_TOKENS": "400"}
+
+  server = ThreadingHTTPServer(("127.0.0.1", 0), StubServer)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  try:
+    async def translate(texts):
+      llm = LLM(max_in_flight=3, base_url=f"http://127.0.0.1:{server.server_port}/v1")
+      with tempfile.TemporaryDirectory() as memory_dir:
+        translation = Translation(llm, TranslationMemory(os.path.join(memory_dir, "memory.sqlite3")))
+        return translation, await translation.translate_lines_with_llm(texts, "en", "ar", "stub/model")
+
+    texts = [f"Subtitle line number {i}" for i in range(60)]
+    with mock.patch.dict(os.environ, environment):
+      translation, translations = asyncio.run(translate(texts))
+  finally:
+    server.shutdown()
+    server.server_close()
+
+  print(f"{translation.requests} batches, {StubServer.requests} HTTP requests, at most {StubServer.max_in_flight} in flight")
+  # Output order follows subtitle order even though batches and items came back shuffled
+  assert translations == [f"T:{text}" for text in texts]
+  assert translation.requests > 3
+  # Each 429 was retried exactly once
+  assert StubServer.requests == translation.requests + StubServer.rate_limited
+  assert StubServer.max_in_flight <= 3
+
+if __name__ == "__main__":
+  test_batched_translation_against_stub_server()
+  print("✅ LLM retries, concurrency limit and ordering work against the stub server")
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Test script for the BS.1770 loudness meter used by the dub mix
+"""
+
+import numpy as np
+from core.dubbed_video_generation import integrated_loudness, _biquad_high_shelf, _biquad_high_pass
+
+def test_k_weighting_coefficients():
+    # ITU-R BS.1770-4, table 1 and 2 (48 kHz)
+    b, a = _biquad_high_shelf(48000)
+    assert np.allclose(b, [1.53512485958697, -2.69169618940638, 1.19839281085285], atol=1e-6)
+    assert np.allclose(a, [1.0, -1.69065929318241, 0.73248077421585], atol=1e-6)
+    b, a = _biquad_high_pass(48000)
+    assert np.allclose(b, [1.0, -2.0, 1.0])
+    assert np.allclose(a, [1.0, -1.99004745483398, 0.99007225036621], atol=1e-6)
+
+def test_reference_tone():
+    # EBU Tech 3341 case 1: 20 s stereo 1 kHz sine at -23 dBFS reads -23.0 LUFS +/- 0.1 LU
+    for sample_rate in (48000, 44100):
+        t = np.arange(20 * sample_rate) / sample_rate
+        tone = 10 ** (-23 / 20) * np.sin(2 * np.pi * 1000 * t)
+        lufs = integrated_loudness(np.stack([tone, tone], axis=1), sample_rate)
+        print(f"{sample_rate} Hz: {lufs:.2f} LUFS")
+        assert abs(lufs + 23) <= 0.1
+
+if __name__ == "__main__":
+    test_k_weighting_coefficients()
+    test_reference_tone()
+    print("✅ Loudness meter matches BS.1770")